@@ -0,0 +1,55 @@
+"""Latency of small batches with a fresh process pool for every batch,
+compared to a BatchSession, that keeps its workers alive.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_batch_session.py
+"""
+import os
+import tempfile
+import time
+
+from pkg_resources import resource_filename
+
+from spotlob.batch import batchprocess, BatchSession, _process_file
+from spotlob.defaults import default_pipeline
+from spotlob.pipeline import Pipeline
+
+TEST_IMAGES = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+BATCH_SIZE = 10
+REPEAT = 5
+
+
+def main():
+    image_files = [resource_filename("spotlob.tests", "resources/" + f)
+                   for f in TEST_IMAGES]
+    batch = (image_files * BATCH_SIZE)[:BATCH_SIZE]
+    pipeline_file = os.path.join(tempfile.mkdtemp(), "bench.pipe")
+    default_pipeline().save(pipeline_file)
+
+    pipeline = Pipeline.from_file(pipeline_file)
+    start = time.perf_counter()
+    for image_file in batch:
+        _process_file(pipeline, image_file)
+    t_serial = time.perf_counter() - start
+    print("serial processing time:    %8.1f ms" % (t_serial * 1e3))
+
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        batchprocess(pipeline_file, batch, executor="processes")
+    t_fresh = (time.perf_counter() - start) / REPEAT
+    print("batchprocess, fresh pool:  %8.1f ms per batch" % (t_fresh * 1e3))
+
+    with BatchSession(executor="processes",
+                      pipeline_files=[pipeline_file]) as session:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            session.process(pipeline_file, batch)
+        t_session = (time.perf_counter() - start) / REPEAT
+    print("BatchSession, warm pool:   %8.1f ms per batch" % (t_session * 1e3))
+
+    os.remove(pipeline_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Time and peak memory of converting, preprocessing and binarizing large
+images, with the processes applied one after another and fused into a
+single pass, see `spotlob.fusion`. Then the same, including the reading
+of a png file, where the fused processes convert the image in the BGR
+order of OpenCV directly.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_fused_binarization.py
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from spotlob.defaults import default_pipeline
+from spotlob.spim import Spim, SpimStage
+
+# megapixels, width and height
+SIZES = [(20, (5472, 3648)), (50, (8660, 5773))]
+REPEAT = 5
+
+
+def synthetic_image(shape):
+    rng = np.random.RandomState(0)
+    image = np.full(shape + (3,), 40, dtype=np.uint8)
+    for x, y in rng.randint(20, min(shape) - 20, size=(2000, 2)):
+        cv2.circle(image, (int(x), int(y)), 12, (220, 200, 180), -1)
+    return image
+
+
+def binarize(pipeline, image):
+    loaded = Spim(image, {"filepath": "synthetic.png"}, SpimStage.loaded,
+                  cached=False, predecessors=dict())
+    return pipeline.apply_from_stage_to_stage(loaded, SpimStage.loaded,
+                                              SpimStage.binarized).image
+
+
+def measure(fn, label):
+    fn()
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    elapsed = (time.perf_counter() - start) / REPEAT
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("%s: %8.1f ms, peak %6.1f MB" % (label, elapsed * 1e3,
+                                            peak / 2**20))
+    return elapsed
+
+
+def read_and_binarize(pipeline, filepath):
+    return pipeline.apply_from_stage_to_stage(Spim.from_file(filepath),
+                                              SpimStage.new,
+                                              SpimStage.binarized).image
+
+
+def main():
+    for megapixels, (width, height) in SIZES:
+        image = synthetic_image((height, width))
+        for thresholding in ["auto", "simple"]:
+            pipeline = default_pipeline(thresholding=thresholding)
+            converter = pipeline.process_stage_dict[SpimStage.loaded]
+            converter.parameters["invert"].value = True
+
+            times = {}
+            for fuse_steps in [False, True]:
+                pipeline.fuse_steps = fuse_steps
+                times[fuse_steps] = measure(
+                    lambda: binarize(pipeline, image),
+                    "%2i MP, %-6s threshold, %-7s"
+                    % (megapixels, thresholding,
+                       "fused" if fuse_steps else "unfused"))
+            print("speedup: %.2f" % (times[False] / times[True]))
+
+        filepath = os.path.join(tempfile.mkdtemp(), "bench.png")
+        cv2.imwrite(filepath, image)
+        pipeline = default_pipeline(thresholding="simple")
+        times = {}
+        for fuse_steps in [False, True]:
+            pipeline.fuse_steps = fuse_steps
+            times[fuse_steps] = measure(
+                lambda: read_and_binarize(pipeline, filepath),
+                "%2i MP, read png,         %-7s"
+                % (megapixels, "fused" if fuse_steps else "unfused"))
+        print("speedup: %.2f" % (times[False] / times[True]))
+        os.remove(filepath)
+        os.rmdir(os.path.dirname(filepath))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Time to collect the results of a batch of 1000 synthetic images with
+:meth:`Spim.get_data`, compared to the former implementation, that merged
+the metadata into the results of every image.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_get_data.py
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from spotlob.spim import Spim, SpimStage
+
+N_IMAGES = 1000
+N_FEATURES = 20
+
+
+def merged_get_data(spim):
+    # get_data as it was before, with a merge for every image
+    md_copy = dict(spim.metadata)
+    results = md_copy.pop("results").assign(filepath=md_copy["filepath"])
+    _ = md_copy.pop("contours")
+    md = pd.Series(md_copy).to_frame().T
+    return results.merge(md, on="filepath")
+
+
+def synthetic_spims():
+    rng = np.random.RandomState(0)
+    spims = []
+    for i in range(N_IMAGES):
+        results = pd.DataFrame({
+            "area_px2": rng.rand(N_FEATURES) * 1000,
+            "ellipse_position_px": list(rng.rand(N_FEATURES, 2)),
+            "ellipse_majorAxis_px": rng.rand(N_FEATURES) * 10,
+            "ellipse_minorAxis_px": rng.rand(N_FEATURES) * 10,
+            "ellipse_angle": rng.rand(N_FEATURES) * 180})
+        metadata = {"filepath": "image_%04i.jpg" % i,
+                    "image_shape": (1040, 1388),
+                    "contours": [],
+                    "results": results}
+        spims.append(Spim(None, metadata, SpimStage.analyzed,
+                          cached=False, predecessors=dict()))
+    return spims
+
+
+def main():
+    spims = synthetic_spims()
+
+    for name, get_data in [("merge per image", merged_get_data),
+                           ("Spim.get_data", Spim.get_data)]:
+        start = time.perf_counter()
+        batch_results = pd.concat([get_data(spim) for spim in spims])
+        elapsed = time.perf_counter() - start
+        print("%-16s %8.1f ms for %i images, %i rows"
+              % (name, elapsed * 1e3, N_IMAGES, len(batch_results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Size and loading time of a pipeline file, stored as json description
+or pickled with dill.
+
+The pipeline reads tif files with a `TifReader`, which has cached a
+preview image, as it does after being used in the notebook gui.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_pipeline_format.py
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from spotlob.defaults import default_pipeline
+from spotlob.pipeline import Pipeline
+from spotlob.process_opencv import TifReader
+
+REPEAT = 100
+
+
+def main():
+    reader = TifReader()
+    reader._preview_image_cache = np.zeros((2000, 2000, 3), np.uint8)
+    pipeline = default_pipeline().replaced_with(reader)
+
+    tempdir = tempfile.mkdtemp()
+    for format in ["dill", "json"]:
+        pipeline_file = os.path.join(tempdir, "bench_%s.pipe" % format)
+        pipeline.save(pipeline_file, format=format)
+
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            Pipeline.from_file(pipeline_file)
+        t_load = (time.perf_counter() - start) / REPEAT
+
+        print("%s: %10i bytes, load %8.2f ms"
+              % (format, os.path.getsize(pipeline_file), t_load * 1e3))
+        os.remove(pipeline_file)
+    os.rmdir(tempdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Per-image overhead of loading the pipeline in batch processing.
+
+Before, every job unpickled the pipeline file with dill, now every
+worker process loads it once. This script measures the time spent on
+loading the pipeline for every image, compared to the processing time,
+and the total time of a multiprocessing batch with different chunk sizes.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_pipeline_loading.py
+"""
+import os
+import tempfile
+import time
+
+from pkg_resources import resource_filename
+
+from spotlob.batch import batchprocess, _process_file
+from spotlob.defaults import default_pipeline
+from spotlob.pipeline import Pipeline
+
+TEST_IMAGES = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+REPEAT = 10
+
+
+def mean_time(fn, repeat=REPEAT):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    image_files = [resource_filename("spotlob.tests", "resources/" + f)
+                   for f in TEST_IMAGES]
+    pipeline_file = os.path.join(tempfile.mkdtemp(), "bench.pipe")
+    default_pipeline().save(pipeline_file)
+    pipeline = Pipeline.from_file(pipeline_file)
+
+    t_load = mean_time(lambda: Pipeline.from_file(pipeline_file))
+    t_process = mean_time(
+        lambda: [_process_file(pipeline, f) for f in image_files]) \
+        / len(image_files)
+
+    print("pipeline load:            %8.2f ms" % (t_load * 1e3))
+    print("processing per image:     %8.2f ms" % (t_process * 1e3))
+    print("per image, load each job: %8.2f ms" % ((t_load + t_process) * 1e3))
+    print("per image, load once:     %8.2f ms" % (t_process * 1e3))
+
+    batch = image_files * REPEAT
+    for chunksize in [1, 4, 16]:
+        start = time.perf_counter()
+        batchprocess(pipeline_file, batch,
+                     multiprocessing=True, chunksize=chunksize)
+        t_batch = (time.perf_counter() - start) / len(batch)
+        print("multiprocessing batch, chunksize %2d: %8.2f ms per image"
+              % (chunksize, t_batch * 1e3))
+
+    os.remove(pipeline_file)
+
+
+if __name__ == "__main__":
+    main()
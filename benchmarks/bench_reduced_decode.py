@@ -0,0 +1,43 @@
+"""Time to read a large JPEG image with the `SimpleReader` at full and
+reduced resolution.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_reduced_decode.py
+"""
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from spotlob.process_opencv import SimpleReader
+
+SHAPE = (4000, 6000, 3)
+REPEAT = 5
+
+
+def main():
+    rng = np.random.RandomState(0)
+    image = np.full(SHAPE, 40, dtype=np.uint8)
+    for x, y in rng.randint(20, min(SHAPE[:2]) - 20, size=(2000, 2)):
+        cv2.circle(image, (int(x), int(y)), 12, (220, 200, 180), -1)
+    filepath = os.path.join(tempfile.mkdtemp(), "bench.jpg")
+    cv2.imwrite(filepath, image)
+
+    reader = SimpleReader()
+    for downscale in [1, 2, 4, 8]:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            read, _ = reader.fn_read(filepath, downscale)
+        elapsed = (time.perf_counter() - start) / REPEAT
+        print("downscale %i: %8.1f ms, %s"
+              % (downscale, elapsed * 1e3, read.shape))
+
+    os.remove(filepath)
+    os.rmdir(os.path.dirname(filepath))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Per image overhead of the Spims and their metadata, that are created
+with every process step, on a synthetic image with many features.
+
+The processes are replaced by stubs, that return precomputed outputs, so
+only the stage transitions of the Spims are timed.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_spim_overhead.py
+"""
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from spotlob.defaults import default_pipeline
+from spotlob.spim import Spim, SpimStage
+
+N_FEATURES = 5000
+SHAPE = (2000, 2000)
+REPEAT = 2000
+
+
+class _Precomputed(object):
+    # a process, that returns a precomputed output
+    def __init__(self, input_stage, output):
+        self.input_stage = input_stage
+        self.output = output
+
+    def apply(self, *input_args):
+        return self.output
+
+
+def feature_dense_image():
+    rng = np.random.RandomState(0)
+    image = np.zeros(SHAPE + (3,), dtype=np.uint8)
+    for x, y in rng.randint(10, SHAPE[0] - 10, size=(N_FEATURES, 2)):
+        cv2.circle(image, (int(x), int(y)), 3, (255, 255, 255), -1)
+    return image
+
+
+def main():
+    pipeline = default_pipeline()
+    feature_filter = pipeline.process_stage_dict[SpimStage.features_extracted]
+    feature_filter.parameters["minimal_area"].value = 10
+    loaded = Spim(feature_dense_image(), {"filepath": "synthetic.png"},
+                  SpimStage.loaded, cached=True, predecessors=dict())
+
+    start = time.perf_counter()
+    analyzed = pipeline.apply_from_stage_to_stage(loaded, SpimStage.loaded,
+                                                  SpimStage.analyzed)
+    t_pipeline = time.perf_counter() - start
+    print("pipeline, %i features:    %8.1f ms per image"
+          % (len(analyzed.metadata["contours"]), t_pipeline * 1e3))
+
+    processes = []
+    for stage in range(SpimStage.loaded, SpimStage.analyzed):
+        after = analyzed.get_at_stage(stage + 1)
+        if stage < SpimStage.postprocessed:
+            output = after.image
+        elif stage < SpimStage.features_filtered:
+            output = after.metadata["contours"]
+        else:
+            output = after.metadata["results"]
+        processes.append(_Precomputed(stage, output))
+
+    def stage_transitions():
+        spim = loaded
+        for process in processes:
+            spim = spim.do_process_at_stage(process)
+        return spim
+
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        stage_transitions()
+    t_transitions = (time.perf_counter() - start) / REPEAT
+    print("stage transitions only:     %8.1f us per image"
+          % (t_transitions * 1e6))
+
+    tracemalloc.start()
+    spims = [stage_transitions() for _ in range(REPEAT)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("memory of the spims:        %8.0f bytes per image"
+          % (size / len(spims)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Time to read a region of interest of 5% of the area from a large, deflate
+compressed tiled tiff, compared to decoding the whole image.
+
+The image is written to a temporary file first, which takes a while.
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/bench_tiff_roi.py
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import tifffile
+
+from spotlob.process_opencv import TifReader
+
+SHAPE = (16000, 16000, 3)
+TILE = (512, 512)
+
+
+def main():
+    # smooth gradients with noise, to be compressible like a real slide
+    rng = np.random.RandomState(0)
+    row = np.linspace(0, 200, SHAPE[1]).astype(np.uint8)
+    image = np.empty(SHAPE, np.uint8)
+    for y in range(0, SHAPE[0], 1000):
+        block = image[y:y + 1000]
+        block[:] = row[None, :, None]
+        block += rng.randint(0, 16, block.shape, dtype=np.uint8)
+
+    filepath = os.path.join(tempfile.mkdtemp(), "bench.tif")
+    tifffile.imwrite(filepath, image, photometric="rgb", tile=TILE,
+                     compression="zlib")
+    del image
+    print("file size: %.0f MB, image %.0f MB"
+          % (os.path.getsize(filepath) / 2**20, np.prod(SHAPE) / 2**20))
+
+    start = time.perf_counter()
+    tifffile.imread(filepath)
+    t_full = time.perf_counter() - start
+
+    # 22.4% x 22.4% is 5% of the area
+    reader = TifReader()
+    start = time.perf_counter()
+    roi, _ = reader.partial_read(filepath, 22.4, 22.4, 40, 40)
+    t_roi = time.perf_counter() - start
+
+    print("full decode:   %8.1f ms" % (t_full * 1e3))
+    print("5%% ROI read:   %8.1f ms, %s" % (t_roi * 1e3, roi.shape))
+    os.remove(filepath)
+    os.rmdir(os.path.dirname(filepath))
+
+
+if __name__ == "__main__":
+    main()
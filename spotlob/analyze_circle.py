@@ -53,7 +53,9 @@ class CircleAnalysis(Analysis):
         if not self.calibration:
             return result
         else:
-            return self.calibration.calibrate(result)
+            # images might have been read at a reduced resolution
+            calibration = self.calibration.scaled(metadata.get("scale", 1))
+            return calibration.calibrate(result)
 
     def draw_results(self, image, dataframe, crop_to_contours=False):
         for _, row in dataframe.iterrows():
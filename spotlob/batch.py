@@ -1,10 +1,17 @@
-import multiprocessing as mp
+import collections
+from concurrent import futures
+import os
+import time
 import warnings
 
 import pandas as pd
 
-from .spim import Spim
+from .spim import Spim, SpimStage
 from .pipeline import Pipeline
+from .process_opencv import StackReader
+from .manifest import ProgressManifest
+from .supervisor import SupervisedProcessPool, JobTimeout, WorkerCrashed
+from .instrumentation import step_column
 
 
 def is_interactive():
@@ -13,17 +20,636 @@ def is_interactive():
     return not hasattr(main, '__file__')
 
 
-def _process_job(job):
-    # function cannot be pickled,
-    # so load function with dill within function call
-    pipeline_file, image_file = job
+BACKENDS = ("serial", "threads", "processes")
+
+# column that is only present in error records
+ERROR_COLUMN = "error"
+
+# a single frame of a stack, that is processed like an image file
+StackFrame = collections.namedtuple("StackFrame", ["filepath", "frame"])
+
+# pipelines loaded within a worker process,
+# by pipeline filepath along with the modification time of the file
+_worker_pipelines = dict()
+
+
+def _worker_pipeline(pipeline_file):
+    """Get the pipeline stored in `pipeline_file`. Within one process,
+    the file is only loaded once and then reused for all further jobs,
+    unless the file has been modified in between"""
+    mtime = os.stat(pipeline_file).st_mtime_ns
+    try:
+        loaded_mtime, pipeline = _worker_pipelines[pipeline_file]
+        if loaded_mtime == mtime:
+            return pipeline
+    except KeyError:
+        pass
     pipeline = Pipeline.from_file(pipeline_file)
-    myspim = Spim.from_file(image_file)
-    processed_spim = pipeline.apply_at_stage(myspim)
-    return processed_spim.get_data()
+    _worker_pipelines[pipeline_file] = (mtime, pipeline)
+    return pipeline
+
+
+def _init_worker(*pipeline_files):
+    # pool initializer: load the pipelines before the first job arrives
+    for pipeline_file in pipeline_files:
+        _worker_pipeline(pipeline_file)
+
+
+def _warm_up():
+    # no-op job, to have the worker started and initialized
+    return os.getpid()
+
+
+def _stack_frames(pipeline, image_files):
+    # with a StackReader, every frame of the stacks is processed on its own.
+    # Stacks, whose frames can not be counted are passed on as they are,
+    # to fail like any other unreadable image
+    reader = pipeline.process_stage_dict.get(SpimStage.new)
+    if not isinstance(reader, StackReader):
+        for image_file in image_files:
+            yield image_file
+        return
+
+    for image_file in image_files:
+        try:
+            n_frames = reader.frame_count(image_file)
+        except Exception:
+            yield image_file
+            continue
+        for frame in range(n_frames):
+            yield StackFrame(image_file, frame)
+
+
+def _new_spim(image_file):
+    if isinstance(image_file, StackFrame):
+        return Spim.from_file(image_file.filepath, frame=image_file.frame)
+    return Spim.from_file(image_file)
+
+
+def _file_columns(image_file):
+    if isinstance(image_file, StackFrame):
+        return {"filepath": image_file.filepath, "frame": image_file.frame}
+    return {"filepath": image_file}
+
+
+def error_record(image_file, exception, stage=None, process=None):
+    """A dataframe with a single row, that describes an error, which
+    occured while processing an image. In a batch process, it replaces
+    the results of the image.
+
+    Parameters
+    ----------
+    image_file : str or StackFrame
+        path of the image, or the frame of a stack
+    exception : Exception
+        the error that occured
+    stage : int, optional
+        SpimStage, that the Spim was in when the error occured
+    process : SpotlobProcessStep, optional
+        the process, that raised the error
+
+    Returns
+    -------
+    pandas.Dataframe
+        with the columns `filepath`, `error_stage`, `error_process`
+        and `error`, and `frame` for the frame of a stack
+    """
+    process_name = None if process is None else type(process).__name__
+    record = dict((k, [v]) for k, v in _file_columns(image_file).items())
+    record.update({"error_stage": [stage],
+                   "error_process": [process_name],
+                   ERROR_COLUMN: ["%s: %s" % (type(exception).__name__,
+                                              exception)]})
+    return pd.DataFrame(record)
+
+
+def is_error_record(dataframe):
+    """True if the dataframe is an error record instead of results"""
+    return ERROR_COLUMN in dataframe.columns
+
+
+def _read_file(reader, image_file, stages=None):
+    # returns the loaded Spim and the time it took, or the Spim restored
+    # from the cached stages, if any, and None
+    if stages is not None:
+        restored = stages.restore(image_file)
+        if restored is not None:
+            return restored, None
+    start = time.perf_counter()
+    loaded = _new_spim(image_file).read(reader)
+    return loaded, time.perf_counter() - start
+
+
+def _read_ahead(pipeline, image_files, depth, stages=None):
+    # yields tuples of image file and a future of the loaded or restored
+    # Spim, while the next `depth` images are read in background threads
+    reader = pipeline.process_stage_dict[SpimStage.new]
+    with futures.ThreadPoolExecutor(max_workers=depth) as readers:
+        pending = collections.deque()
+        try:
+            for image_file in image_files:
+                pending.append((image_file,
+                                readers.submit(_read_file,
+                                               reader,
+                                               image_file,
+                                               stages)))
+                if len(pending) > depth:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def _timing_record(image_file):
+    record = _file_columns(image_file)
+    try:
+        record["file_bytes"] = os.path.getsize(record["filepath"])
+    except OSError:
+        # the error is raised or recorded, when the file is read
+        record["file_bytes"] = None
+    return record
+
+
+def _record_spim(record, spim):
+    # add sizes and feature counts of a spim, that has just been created
+    if spim.stage == SpimStage.loaded:
+        record["image_bytes"] = spim.image.nbytes
+    elif spim.stage == SpimStage.features_extracted:
+        record["n_features_extracted"] = len(spim.metadata["contours"])
+    elif spim.stage == SpimStage.features_filtered:
+        record["n_features_filtered"] = len(spim.metadata["contours"])
 
 
-def batchprocess(pipeline_file, image_files, multiprocessing=False):
+def _process_file(pipeline, image_file, errors="raise", prefetched=None,
+                  instrument=False, stages=None):
+    # returns the result and a timing record, if instrument is True.
+    # stages are the cached stages of the pipeline, if any
+    myspim = _new_spim(image_file)
+    record = _timing_record(image_file) if instrument else None
+    process = None
+    try:
+        if prefetched is not None:
+            # the image has been read or restored in the background already
+            process = pipeline.process_stage_dict[SpimStage.new]
+            myspim, elapsed = prefetched.result()
+            if elapsed is not None:
+                if instrument:
+                    record[step_column(SpimStage.new)] = elapsed
+                    _record_spim(record, myspim)
+                if stages is not None:
+                    stages.record(image_file, myspim)
+        elif stages is not None:
+            restored = stages.restore(image_file)
+            if restored is not None:
+                myspim = restored
+
+        # apply step by step, to know which one failed
+        # and how long every step takes, or fused where the
+        # intermediate stages are neither timed nor cached
+        fuse = not instrument and stages is None
+        stage = myspim.stage
+        while stage < pipeline._maxstage():
+            fused = None
+            if fuse:
+                fused = pipeline._fused_steps(myspim, stage,
+                                              pipeline._maxstage())
+            if fused is not None:
+                try:
+                    myspim = fused.apply_to_spim(myspim)
+                    stage = fused.output_stage
+                except Exception:
+                    # again step by step, to know which process failed
+                    fuse = False
+                continue
+
+            process = pipeline.process_stage_dict[stage]
+            start = time.perf_counter()
+            myspim = myspim.do_process_at_stage(process)
+            if instrument:
+                record[step_column(stage)] = time.perf_counter() - start
+                _record_spim(record, myspim)
+            if stages is not None:
+                stages.record(image_file, myspim)
+            stage += 1
+
+        process = None
+        start = time.perf_counter()
+        result = myspim.get_data()
+        if instrument:
+            record["get_data_s"] = time.perf_counter() - start
+            record["total_s"] = sum(v for k, v in record.items()
+                                    if k.endswith("_s"))
+        return result, record
+    except Exception as e:
+        if errors == "raise":
+            raise
+        return error_record(image_file, e, myspim.stage, process), None
+
+
+def _iter_processed(pipeline, image_files, options):
+    # yields tuples of image file, result and timing record,
+    # processed in this thread
+    errors = options["errors"]
+    prefetch = options["prefetch"]
+    instrument = options["instrument"]
+    stages = None
+    if options["stage_cache"] is not None:
+        stages = options["stage_cache"].for_pipeline(pipeline)
+
+    if prefetch > 0 and SpimStage.new in pipeline.process_stage_dict:
+        for image_file, read in _read_ahead(pipeline, image_files, prefetch,
+                                            stages):
+            result, record = _process_file(pipeline, image_file,
+                                           errors, read, instrument, stages)
+            yield image_file, result, record
+    else:
+        for image_file in image_files:
+            result, record = _process_file(pipeline, image_file,
+                                           errors, None, instrument, stages)
+            yield image_file, result, record
+
+
+def _process_chunk(job):
+    # the pipeline cannot be pickled with the standard pickler,
+    # so it is loaded from file with dill once per worker process.
+    # In a thread pool, all threads share the same pipeline.
+    # Returns the results along with the stage cache entries used, if the
+    # stage cache is a copy in a worker process
+    pipeline_file, image_files, options = job
+    pipeline = _worker_pipeline(pipeline_file)
+    results = list(_iter_processed(pipeline, image_files, options))
+    journal = []
+    if options["stage_cache"] is not None:
+        journal = options["stage_cache"].take_journal()
+    return results, journal
+
+
+def _chunk_result(future, job):
+    # results of a finished job, if the worker failed and errors are
+    # recorded, there is an error record for every image of the job
+    _, image_files, options = job
+    try:
+        results, journal = future.result()
+    except (JobTimeout, WorkerCrashed, futures.BrokenExecutor) as e:
+        if options["errors"] == "raise":
+            raise
+        return [(image_file, error_record(image_file, e), None)
+                for image_file in image_files]
+
+    if journal:
+        # the size of the stage cache is kept and limited in this process
+        options["stage_cache"].apply_journal(journal)
+    return results
+
+
+def _chunked(iterable, chunksize):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_ordered(executor, jobs, max_in_flight):
+    # keep at most max_in_flight jobs submitted, yield in submission order
+    pending = collections.deque()
+    try:
+        for job in jobs:
+            pending.append((executor.submit(_process_chunk, job), job))
+            if len(pending) >= max_in_flight:
+                yield _chunk_result(*pending.popleft())
+        while pending:
+            yield _chunk_result(*pending.popleft())
+    finally:
+        for future, _ in pending:
+            future.cancel()
+
+
+def _iter_unordered(executor, jobs, max_in_flight):
+    # keep at most max_in_flight jobs submitted, yield as they finish
+    pending = dict()
+    try:
+        for job in jobs:
+            pending[executor.submit(_process_chunk, job)] = job
+            if len(pending) >= max_in_flight:
+                done, _ = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    yield _chunk_result(future, pending.pop(future))
+        for future in futures.as_completed(list(pending)):
+            yield _chunk_result(future, pending.pop(future))
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _iter_parallel(pool, pipeline_file, image_files,
+                   ordered, max_in_flight, chunksize, options):
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    if chunksize < 1:
+        raise ValueError("chunksize must be at least 1")
+    if options["prefetch"] > 0 and chunksize == 1:
+        warnings.warn("prefetch has no effect in parallel execution with a "
+                      "chunksize of 1, the images are only read ahead within "
+                      "every job of chunksize images")
+    max_chunks_in_flight = max(1, max_in_flight // chunksize)
+
+    jobs = ((pipeline_file, chunk, options)
+            for chunk in _chunked(image_files, chunksize))
+    if ordered:
+        chunk_results = _iter_ordered(pool, jobs, max_chunks_in_flight)
+    else:
+        chunk_results = _iter_unordered(pool, jobs, max_chunks_in_flight)
+    for chunk_result in chunk_results:
+        for result in chunk_result:
+            yield result
+
+
+def _make_executor(backend, workers, pipeline_files, options):
+    if options["timeout"] is not None and backend != "processes":
+        raise ValueError("timeout is only supported by the processes "
+                         "backend")
+
+    if backend == "threads":
+        return futures.ThreadPoolExecutor(max_workers=workers)
+    elif backend == "processes":
+        if is_interactive():
+            warnings.warn(
+                """It seems you are running in an interactive environment.
+                Multiprocessing might not work.
+                Consider using ipyparallel instead""")
+        if options["errors"] == "record" or options["timeout"] is not None:
+            # crashed or hung workers are replaced, without affecting
+            # the other jobs
+            return SupervisedProcessPool(max_workers=workers,
+                                         timeout=options["timeout"],
+                                         initializer=_init_worker,
+                                         initargs=tuple(pipeline_files))
+        return futures.ProcessPoolExecutor(max_workers=workers,
+                                           initializer=_init_worker,
+                                           initargs=tuple(pipeline_files))
+    else:
+        raise ValueError("Unknown executor backend %s, use one of %s"
+                         % (backend, ", ".join(BACKENDS)))
+
+
+def _job_options(errors, timeout, prefetch, instrument=False,
+                 stage_cache=None):
+    # options, that are sent along with every job
+    if errors not in ("raise", "record"):
+        raise ValueError("errors must be 'raise' or 'record'")
+    if prefetch < 0:
+        raise ValueError("prefetch must not be negative")
+    return {"errors": errors,
+            "timeout": timeout,
+            "prefetch": prefetch,
+            "instrument": instrument,
+            "stage_cache": stage_cache}
+
+
+def _iter_results(pipeline_file, image_files, ordered, max_in_flight,
+                  chunksize, executor, workers, options):
+    # yields tuples of image file, result and timing record
+    if executor == "serial":
+        if options["timeout"] is not None:
+            raise ValueError("timeout is only supported by the processes "
+                             "backend")
+        pipeline = Pipeline.from_file(pipeline_file)
+
+        for result in _iter_processed(pipeline, image_files, options):
+            yield result
+        return
+
+    if workers is None:
+        workers = os.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    if isinstance(executor, futures.Executor):
+        pool = executor
+        owns_pool = False
+    else:
+        pool = _make_executor(executor, workers, [pipeline_file], options)
+        owns_pool = True
+
+    try:
+        for result in _iter_parallel(pool, pipeline_file, image_files,
+                                     ordered, max_in_flight, chunksize,
+                                     options):
+            yield result
+    finally:
+        if owns_pool:
+            pool.shutdown(wait=True)
+
+
+def _iter_stored(store, image_files, ordered, process_files):
+    # yields tuples of image file, result and timing record, taking the
+    # results of finished images from the store (a progress manifest or
+    # a result cache) and processing only the others with process_files,
+    # recording their results in the store.
+    # Results from the store have no timing record
+    waiting = collections.deque()
+
+    def unfinished():
+        for image_file in image_files:
+            is_finished = store.finished(image_file)
+            if ordered or is_finished:
+                waiting.append((image_file, is_finished))
+            if not is_finished:
+                yield image_file
+
+    def finished_from_manifest():
+        while waiting and waiting[0][1]:
+            image_file, _ = waiting.popleft()
+            yield image_file, store.load_result(image_file), None
+
+    for image_file, result, record in process_files(unfinished()):
+        if not is_error_record(result):
+            # failed images are tried again in the next run
+            store.record(image_file, result)
+        for finished in finished_from_manifest():
+            yield finished
+        if ordered:
+            # this is the entry of the image just processed
+            waiting.popleft()
+        yield image_file, result, record
+
+    for finished in finished_from_manifest():
+        yield finished
+
+
+def batchprocess_iter(pipeline_file,
+                      image_files,
+                      multiprocessing=False,
+                      ordered=True,
+                      max_in_flight=None,
+                      chunksize=1,
+                      executor=None,
+                      workers=None,
+                      checkpoint=None,
+                      errors="raise",
+                      timeout=None,
+                      prefetch=0,
+                      statistics=None,
+                      cache=None,
+                      stage_cache=None):
+    """Applies a pipeline from a file onto a stack of images and yields
+    the results image by image, as soon as they are available.
+    In contrast to :func:`batchprocess`, the results are not collected,
+    so memory use does not grow with the number of images.
+
+    PARAMETERS
+    ----------
+    pipeline_file : str
+        the filepath of a pickled pipeline
+    image_files : iterable of str
+        paths of the images, may also be a generator. If the reader of the
+        pipeline is a :class:`~spotlob.process_opencv.StackReader`, these
+        are stacks, like multi-page tiffs or videos, and every frame is
+        processed like a single image, with its index in the `frame`
+        column of the results
+    multiprocessing : bool, optional
+        if True, the processing will be done in parallel using multiple cpu
+        cores at once. This is the same as `executor="processes"`
+    ordered : bool, optional
+        if True (default), the results are yielded in the order of
+        `image_files`, otherwise in the order they are finished
+    max_in_flight : int, optional
+        maximum number of images, that are submitted for processing but
+        whose results have not been yielded yet. Only used for parallel
+        execution, defaults to twice the number of workers
+    chunksize : int, optional
+        number of images that are sent to a worker as one job.
+        Larger chunks reduce the communication overhead for many small
+        images. Only used for parallel execution, the default is 1
+    executor : str or concurrent.futures.Executor, optional
+        how the images are processed, one of
+
+        - `"serial"`, one after another in this process
+        - `"threads"`, in parallel in a thread pool. Most opencv functions
+          release the GIL, so this avoids the cost of starting processes
+          and transferring the results between them
+        - `"processes"`, in parallel in a process pool
+        - an instance of :class:`concurrent.futures.Executor`, which is
+          used for the jobs, but is not shut down afterwards
+
+        by default "serial", or "processes" if `multiprocessing` is True
+    workers : int, optional
+        number of threads or processes for the "threads" and "processes"
+        backends, defaults to the number of cpu cores
+    checkpoint : str, optional
+        path of a progress manifest. If given, the result of every finished
+        image is recorded in the manifest. When the batch is run again with
+        the same manifest, images that are already finished with the same
+        pipeline are not processed again, but their results are taken from
+        the manifest. Images are identified by their path, size and
+        modification time
+    errors : str, optional
+        if "raise" (default), an error while processing an image stops the
+        batch. If "record", the error is caught and an error record as
+        created by :func:`error_record` is yielded instead of the results
+        of the image, so all other images are still processed. With the
+        "processes" backend, crashed workers are replaced
+    timeout : float, optional
+        time limit in seconds for processing one job of `chunksize` images.
+        A worker that exceeds it is replaced by a new one. The job fails
+        with :class:`~spotlob.supervisor.JobTimeout`, or yields error
+        records if `errors` is "record". Only supported by the "processes"
+        backend
+    prefetch : int, optional
+        number of images, that are read ahead in background threads, while
+        the current image is processed. This helps on slow storage, where
+        reading the image takes a considerable part of the time. In parallel
+        execution, the images are read ahead within every job of
+        `chunksize` images, so it has no effect with a `chunksize` of 1.
+        Images, that are restored from the `stage_cache`, are not read.
+        By default 0, i.e. no images are read ahead
+    statistics : BatchStatistics, optional
+        if given, the time of every process step, the size and the number
+        of features of every image are recorded in this
+        :class:`~spotlob.instrumentation.BatchStatistics` object
+    cache : ResultCache, optional
+        if given, the results of images, that have already been processed
+        with the same pipeline are taken from this
+        :class:`~spotlob.cache.ResultCache`. Only new or modified images are
+        processed and their results are added to the cache
+    stage_cache : StageCache, optional
+        if given, the intermediate stages of every image are stored in this
+        :class:`~spotlob.cache.StageCache`, and every image is processed
+        starting from the latest stage, that has been stored with the same
+        processes before
+
+    YIELDS
+    ------
+    pandas.Dataframe
+        results of one image, as returned by :meth:`Spim.get_data`
+    """
+    if executor is None:
+        executor = "processes" if multiprocessing else "serial"
+    options = _job_options(errors, timeout, prefetch,
+                           instrument=statistics is not None,
+                           stage_cache=stage_cache)
+
+    pipeline = _worker_pipeline(pipeline_file)
+    if isinstance(pipeline.process_stage_dict.get(SpimStage.new),
+                  StackReader):
+        if checkpoint is not None or cache is not None or \
+                stage_cache is not None:
+            raise ValueError("checkpoint, cache and stage_cache are not "
+                             "supported for stacks")
+        image_files = _stack_frames(pipeline, image_files)
+
+    def process_files(files):
+        return _iter_results(pipeline_file, files, ordered, max_in_flight,
+                             chunksize, executor, workers, options)
+
+    if cache is not None:
+        cached_results = cache.for_pipeline(pipeline)
+
+        def process_uncached(files):
+            return _iter_stored(cached_results, files, ordered,
+                                process_files)
+    else:
+        process_uncached = process_files
+
+    manifest = None
+    if checkpoint is not None:
+        manifest = ProgressManifest.for_pipeline_file(checkpoint,
+                                                      pipeline_file)
+        results = _iter_stored(manifest, image_files, ordered,
+                               process_uncached)
+    else:
+        results = process_uncached(image_files)
+
+    try:
+        for result in _collect_statistics(results, statistics):
+            yield result
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+
+def _collect_statistics(results, statistics):
+    # yields the results only, adding the timing records to statistics
+    if statistics is not None:
+        statistics.start()
+
+    for _, result, record in results:
+        if statistics is not None and record is not None:
+            statistics.add(record)
+        yield result
+
+
+def batchprocess(pipeline_file, image_files, multiprocessing=False,
+                 chunksize=1, executor=None, workers=None, checkpoint=None,
+                 errors="raise", timeout=None, prefetch=0, statistics=None,
+                 cache=None, stage_cache=None):
     """This function applies a pipeline from a file onto a stack of images.
     The results are collected in one :class:`pandas.Dataframe`.
 
@@ -32,41 +658,214 @@ def batchprocess(pipeline_file, image_files, multiprocessing=False):
     pipeline_file : str
         the filepath of a pickled pipeline
     image_files : list of str
-        paths of the images
+        paths of the images, or the stacks of images,
+        see :func:`batchprocess_iter`
     multiprocessing : bool, optional
         if True, the processing will be done in parallel using multiple cpu
         cores at once.
-    
+    chunksize : int, optional
+        number of images that are sent to a worker process as one job,
+        see :func:`batchprocess_iter`
+    executor : str or concurrent.futures.Executor, optional
+        "serial", "threads", "processes" or an executor instance to run
+        the jobs with, see :func:`batchprocess_iter`
+    workers : int, optional
+        number of threads or processes, defaults to the number of cpu cores
+    checkpoint : str, optional
+        path of a progress manifest, to resume an interrupted batch,
+        see :func:`batchprocess_iter`
+    errors : str, optional
+        "raise" (default) or "record", to replace the results of images,
+        that could not be processed with an error record,
+        see :func:`batchprocess_iter`
+    timeout : float, optional
+        time limit in seconds per job for the "processes" backend
+    prefetch : int, optional
+        number of images, that are read ahead in background threads,
+        see :func:`batchprocess_iter`
+    statistics : BatchStatistics, optional
+        to record the time of every process step for every image
+    cache : ResultCache, optional
+        to take the results of unchanged images from,
+        see :func:`batchprocess_iter`
+    stage_cache : StageCache, optional
+        to store intermediate stages and start from them when the images
+        are processed again, see :func:`batchprocess_iter`
+
     RETURNS
     -------
     pandas.Dataframe
         Flat Dataframe where one row corresponds to one detected feature
+
+    See also
+    --------
+    batchprocess_iter
+        to get the results image by image instead
     """
-    if multiprocessing:
-        if is_interactive():
-            warnings.warn(
-                """It seems you are running in an interactive environment.
-                Multiprocessing might not work.
-                Consider using ipyparallel instead""")
+    res = batchprocess_iter(pipeline_file,
+                            image_files,
+                            multiprocessing=multiprocessing,
+                            chunksize=chunksize,
+                            executor=executor,
+                            workers=workers,
+                            checkpoint=checkpoint,
+                            errors=errors,
+                            timeout=timeout,
+                            prefetch=prefetch,
+                            statistics=statistics,
+                            cache=cache,
+                            stage_cache=stage_cache)
+    #
+    # make large dataframe out of list of dataframes
+    return pd.concat(res)
 
-        jobs = zip([pipeline_file]*len(image_files), image_files)
-        no_cores = mp.cpu_count()
-        pool = mp.Pool(processes=no_cores)
-        try:
-            res = pool.map(_process_job, jobs)
-        finally:
-            pool.close()
-            pool.join()
 
-    else:
-        pipeline = Pipeline.from_file(pipeline_file)
+class BatchSession(object):
+    """A batch session keeps a pool of workers alive, to process
+    several batches of images one after another, without starting the
+    workers again for every batch. The workers keep the pipelines they
+    have loaded, so only the first batch with a given pipeline file
+    pays for loading it.
 
-        def process_file(fn):
-            myspim = Spim.from_file(fn)
-            respim = pipeline.apply_at_stage(myspim)
-            return respim.get_data()
+    Example
+    -------
 
-        res = map(process_file, image_files)
-    #
-    # make large dataframe out of list of dataframes
-    return pd.concat(res)
+    .. code-block:: python
+
+        from spotlob.batch import BatchSession
+
+        with BatchSession(pipeline_files=["my_pipe.pipe"]) as session:
+            for image_files in new_image_files():
+                results = session.process("my_pipe.pipe", image_files)
+    """
+
+    def __init__(self,
+                 executor="processes",
+                 workers=None,
+                 pipeline_files=(),
+                 chunksize=1,
+                 max_in_flight=None,
+                 errors="raise",
+                 timeout=None,
+                 prefetch=0):
+        """
+        Parameters
+        ----------
+        executor : str, optional
+            "serial", "threads" or "processes" (default)
+        workers : int, optional
+            number of threads or processes, defaults to the number of
+            cpu cores
+        pipeline_files : list of str, optional
+            pipelines to load in every worker right away
+        chunksize : int, optional
+            number of images that are sent to a worker as one job,
+            the default is 1
+        max_in_flight : int, optional
+            maximum number of images in processing at once, defaults to
+            twice the number of workers
+        errors : str, optional
+            "raise" (default) or "record", see :func:`batchprocess_iter`
+        timeout : float, optional
+            time limit in seconds per job, only for the "processes" backend
+        prefetch : int, optional
+            number of images, that are read ahead in background threads,
+            see :func:`batchprocess_iter`
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        self.executor = executor
+        self.workers = workers
+        self.chunksize = chunksize
+        if max_in_flight is None:
+            max_in_flight = 2 * workers
+        self.max_in_flight = max_in_flight
+        self._options = _job_options(errors, timeout, prefetch)
+
+        if executor == "serial":
+            if timeout is not None:
+                raise ValueError("timeout is only supported by the "
+                                 "processes backend")
+            self._pool = None
+            _init_worker(*pipeline_files)
+        else:
+            self._pool = _make_executor(executor, workers, pipeline_files,
+                                        self._options)
+            # start all workers now, instead of with the first batch
+            warm_up_jobs = [self._pool.submit(_warm_up)
+                            for _ in range(workers)]
+            futures.wait(warm_up_jobs)
+
+    def process_iter(self, pipeline_file, image_files, ordered=True,
+                     statistics=None):
+        """Apply the pipeline stored in `pipeline_file` onto images,
+        yielding the results image by image
+
+        Parameters
+        ----------
+        pipeline_file : str
+            the filepath of a pickled pipeline
+        image_files : iterable of str
+            paths of the images
+        ordered : bool, optional
+            if True (default), the results are yielded in the order of
+            `image_files`, otherwise in the order they are finished
+        statistics : BatchStatistics, optional
+            to record the time of every process step for every image
+
+        Yields
+        ------
+        pandas.Dataframe
+            results of one image, as returned by :meth:`Spim.get_data`
+        """
+        options = dict(self._options, instrument=statistics is not None)
+        pipeline = _worker_pipeline(pipeline_file)
+        image_files = _stack_frames(pipeline, image_files)
+
+        if self.executor == "serial":
+            results = _iter_processed(pipeline, image_files, options)
+        else:
+            if self._pool is None:
+                raise RuntimeError("BatchSession has been closed")
+            results = _iter_parallel(self._pool, pipeline_file,
+                                     image_files, ordered,
+                                     self.max_in_flight,
+                                     self.chunksize,
+                                     options)
+
+        for result in _collect_statistics(results, statistics):
+            yield result
+
+    def process(self, pipeline_file, image_files, statistics=None):
+        """Apply the pipeline stored in `pipeline_file` onto images and
+        collect the results in one :class:`pandas.Dataframe`, like
+        :func:`batchprocess`
+
+        Parameters
+        ----------
+        pipeline_file : str
+            the filepath of a pickled pipeline
+        image_files : list of str
+            paths of the images
+        statistics : BatchStatistics, optional
+            to record the time of every process step for every image
+
+        Returns
+        -------
+        pandas.Dataframe
+            Flat Dataframe where one row corresponds to one detected feature
+        """
+        return pd.concat(self.process_iter(pipeline_file, image_files,
+                                           statistics=statistics))
+
+    def close(self):
+        """Stop the workers"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
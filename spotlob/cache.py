@@ -0,0 +1,425 @@
+"""
+Caches on disk, to avoid processing the same image with the same pipeline
+again. Images are identified by a hash of their content, so a cached
+result is found even if an image has been copied or renamed, and an
+image that has been modified is processed again.
+
+.. code-block:: python
+
+    from spotlob.batch import batchprocess
+    from spotlob.cache import ResultCache
+
+    cache = ResultCache("spotlob_cache", max_bytes=10**9)
+    results = batchprocess("my_pipe.pipe", image_files, cache=cache)
+
+The :class:`StageCache` stores intermediate stages instead, so when only
+the parameters of later process steps change, the earlier ones are not
+applied again.
+
+.. code-block:: python
+
+    from spotlob.cache import StageCache
+
+    stage_cache = StageCache("spotlob_stages", max_bytes=10**10)
+    results = batchprocess("my_pipe.pipe", image_files,
+                           stage_cache=stage_cache)
+"""
+import collections
+import os
+import pickle
+import shutil
+import threading
+
+from .manifest import file_hash
+from .spim import Spim, SpimStage
+
+
+class ResultCache(object):
+    """Stores the results of :meth:`Spim.get_data` for every image,
+    keyed by the hash of the image file and the fingerprint of the
+    pipeline. If the cache grows larger than `max_bytes`, the least
+    recently used results are removed.
+
+    The results of every pipeline are stored in their own subdirectory,
+    named by the fingerprint of the pipeline.
+    """
+
+    def __init__(self, directory, max_bytes=2**30):
+        """
+        Parameters
+        ----------
+        directory : str
+            directory to store the cache in, it is created if it does
+            not exist
+        max_bytes : int, optional
+            maximum size of all cached results, by default 1 GiB
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # paths of all entries and their size, least recently used first
+        entries = []
+        for root, _, files in os.walk(directory):
+            for f in files:
+                path = os.path.join(root, f)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        self._entries = collections.OrderedDict(
+            (path, size) for _, path, size in sorted(entries))
+        self.size = sum(self._entries.values())
+        # entries, that are about to be loaded and must not be removed
+        self._pinned = collections.Counter()
+        # entries used by a copy in another process, see __getstate__
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # a copy sent to another process does not track the sizes and does
+        # not remove entries itself. It lists the entries it has used in
+        # its journal, to be applied by the original, see apply_journal
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_entries"] = collections.OrderedDict()
+        state["size"] = 0
+        state["_pinned"] = collections.Counter()
+        state["_journal"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _used(self, path, size):
+        # mark an entry as recently used, or add it
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((path, size))
+            elif path in self._entries:
+                self._entries.move_to_end(path)
+            else:
+                self._entries[path] = size
+                self.size += size
+
+    def take_journal(self):
+        """The entries used by this copy of a cache in another process,
+        since the last call, as list of path and size"""
+        with self._lock:
+            journal = self._journal or []
+            if self._journal is not None:
+                self._journal = []
+        return journal
+
+    def apply_journal(self, journal):
+        """Track the entries used by a copy of this cache in another
+        process, and remove the least recently used entries, if the cache
+        has grown too large
+
+        Parameters
+        ----------
+        journal : list of tuple
+            path and size of the used entries, see :meth:`take_journal`
+        """
+        with self._lock:
+            for path, size in journal:
+                self.size -= self._entries.pop(path, 0)
+                if os.path.exists(path):
+                    self._entries[path] = size
+                    self.size += size
+            self._evict()
+
+    def _entry_path(self, fingerprint, content_hash):
+        return os.path.join(self.directory, fingerprint,
+                            content_hash + ".pkl")
+
+    def get(self, fingerprint, content_hash):
+        """Get a cached result
+
+        Parameters
+        ----------
+        fingerprint : str
+            fingerprint of the pipeline, see :meth:`Pipeline.fingerprint`
+        content_hash : str
+            hash of the image file
+
+        Returns
+        -------
+        pandas.Dataframe or None
+            cached result, or None if there is none
+        """
+        path = self._entry_path(fingerprint, content_hash)
+        try:
+            # the entry might have been added or removed by another process
+            with open(path, "rb") as f_:
+                result = pickle.load(f_)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.size -= self._entries.pop(path, 0)
+            return None
+
+        self._used(path, os.path.getsize(path))
+        return result
+
+    def _touch(self, fingerprint, content_hash, pin=False):
+        # True if the entry exists, which is then marked as recently used
+        # and, if pin is True, not removed until it is unpinned
+        path = self._entry_path(fingerprint, content_hash)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except OSError:
+            with self._lock:
+                self.size -= self._entries.pop(path, 0)
+            return False
+
+        self._used(path, size)
+        if pin:
+            with self._lock:
+                self._pinned[path] += 1
+        return True
+
+    def _unpin(self, fingerprint, content_hash):
+        path = self._entry_path(fingerprint, content_hash)
+        with self._lock:
+            self._pinned[path] -= 1
+            if self._pinned[path] <= 0:
+                del self._pinned[path]
+            self._evict()
+
+    def put(self, fingerprint, content_hash, result):
+        """Store a result and remove the least recently used results
+        if the cache is full
+
+        Parameters
+        ----------
+        fingerprint : str
+            fingerprint of the pipeline, see :meth:`Pipeline.fingerprint`
+        content_hash : str
+            hash of the image file
+        result : pandas.Dataframe
+            result to store
+        """
+        path = self._entry_path(fingerprint, content_hash)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        # write to a temporary file first, so there are no partial entries
+        temp_path = "%s.%i.%i.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(temp_path, "wb") as f_:
+            pickle.dump(result, f_, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+        size = os.path.getsize(path)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((path, size))
+                return
+            self.size -= self._entries.pop(path, 0)
+            self._entries[path] = size
+            self.size += size
+            self._evict()
+
+    def _evict(self):
+        for path in list(self._entries):
+            if self.size <= self.max_bytes:
+                break
+            if path in self._pinned:
+                continue
+            self.size -= self._entries.pop(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def invalidate(self, pipeline):
+        """Remove all results of a pipeline
+
+        Parameters
+        ----------
+        pipeline : Pipeline or str
+            the pipeline or its fingerprint
+        """
+        if isinstance(pipeline, str):
+            fingerprint = pipeline
+        else:
+            fingerprint = pipeline.fingerprint()
+        self._remove_fingerprint(fingerprint)
+
+    def _remove_fingerprint(self, fingerprint):
+        pipeline_dir = os.path.join(self.directory, fingerprint)
+        with self._lock:
+            for path in list(self._entries):
+                if os.path.dirname(path) == pipeline_dir:
+                    self.size -= self._entries.pop(path)
+        shutil.rmtree(pipeline_dir, ignore_errors=True)
+
+    def clear(self):
+        """Remove all results"""
+        for fingerprint in os.listdir(self.directory):
+            self._remove_fingerprint(fingerprint)
+
+    def for_pipeline(self, pipeline):
+        """A view on the results of one pipeline, that can be used like
+        a :class:`~spotlob.manifest.ProgressManifest` in a batch process"""
+        return _PipelineResults(self, pipeline.fingerprint())
+
+
+class _PipelineResults(object):
+    # the results of one pipeline, looked up by image file. A file might
+    # be listed several times, so the hashes are queued per file, in the
+    # order in which finished has been called
+
+    def __init__(self, cache, fingerprint):
+        self.cache = cache
+        self.fingerprint = fingerprint
+        # hashes of files, that have not been recorded yet
+        self._unrecorded = collections.defaultdict(collections.deque)
+        # hashes of files found in the cache, that have not been loaded yet
+        self._found = collections.defaultdict(collections.deque)
+
+    @staticmethod
+    def _next_hash(hashes, image_file):
+        content_hash = hashes[image_file].popleft()
+        if not hashes[image_file]:
+            del hashes[image_file]
+        return content_hash
+
+    def finished(self, image_file):
+        try:
+            content_hash = file_hash(image_file)
+        except OSError:
+            # the error is raised or recorded, when the file is processed,
+            # and its result is not recorded
+            return False
+        # the result is only loaded when it is its turn, until then it is
+        # pinned, so it is not removed from the cache
+        if self.cache._touch(self.fingerprint, content_hash, pin=True):
+            self._found[image_file].append(content_hash)
+            return True
+        self._unrecorded[image_file].append(content_hash)
+        return False
+
+    def load_result(self, image_file):
+        content_hash = self._next_hash(self._found, image_file)
+        try:
+            result = self.cache.get(self.fingerprint, content_hash)
+        finally:
+            self.cache._unpin(self.fingerprint, content_hash)
+        if result is None:
+            raise KeyError("The result of %s has been removed from the "
+                           "cache by another process" % image_file)
+        # the same content might have been cached from another path,
+        # the column keeps its dtype
+        result.loc[:, "filepath"] = image_file
+        return result
+
+    def record(self, image_file, result):
+        self.cache.put(self.fingerprint,
+                       self._next_hash(self._unrecorded, image_file),
+                       result)
+
+    def close(self):
+        pass
+
+
+class StageCache(ResultCache):
+    """Stores intermediate stages of the images of a batch: the images of
+    the stages up to `SpimStage.postprocessed` and the contours of the
+    stages `features_extracted` and `features_filtered`, together with the
+    metadata. Every stage is keyed by the hash of the image file and the
+    fingerprint of the processes, that have been applied before it, see
+    :meth:`Pipeline.fingerprint`.
+
+    When the same images are processed again, the processing starts from
+    the latest stage, that is still valid. If for example only the
+    parameters of the feature filter have changed, the contours are taken
+    from the cache and only the filter and the analysis are applied.
+
+    Restored Spims have no predecessors.
+    """
+
+    def __init__(self, directory, max_bytes=2**30,
+                 stages=range(SpimStage.loaded,
+                              SpimStage.features_filtered + 1)):
+        """
+        Parameters
+        ----------
+        directory : str
+            directory to store the cache in, it is created if it does
+            not exist
+        max_bytes : int, optional
+            maximum size of all cached stages, by default 1 GiB
+        stages : iterable of int, optional
+            SpimStages to store, by default all from `loaded` to
+            `features_filtered`
+        """
+        super(StageCache, self).__init__(directory, max_bytes)
+        self.stages = sorted(stages)
+
+    def invalidate(self, pipeline):
+        """Remove all stages of a pipeline
+
+        Parameters
+        ----------
+        pipeline : Pipeline
+            the pipeline
+        """
+        for stage in self.stages:
+            self._remove_fingerprint(pipeline.fingerprint(stage))
+
+    def for_pipeline(self, pipeline):
+        """A view on the stages of one pipeline, to restore and record the
+        stages of single images"""
+        fingerprints = dict((stage, pipeline.fingerprint(stage))
+                            for stage in self.stages
+                            if stage <= pipeline._maxstage())
+        return _PipelineStages(self, fingerprints)
+
+
+class _PipelineStages(object):
+    # the stages of one pipeline, looked up by image file. Images might be
+    # restored in background threads, while others are recorded
+
+    # number of images, whose hashes are kept
+    max_hashes = 64
+
+    def __init__(self, cache, fingerprints):
+        self.cache = cache
+        self.fingerprints = fingerprints
+        self._hashes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _content_hash(self, image_file):
+        with self._lock:
+            if image_file in self._hashes:
+                self._hashes.move_to_end(image_file)
+                return self._hashes[image_file]
+        content_hash = file_hash(image_file)
+        with self._lock:
+            self._hashes[image_file] = content_hash
+            while len(self._hashes) > self.max_hashes:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+    def restore(self, image_file):
+        """The Spim at the latest stage, that has been cached for this
+        image, or None"""
+        content_hash = self._content_hash(image_file)
+        for stage in sorted(self.fingerprints, reverse=True):
+            entry = self.cache.get(self.fingerprints[stage], content_hash)
+            if entry is not None:
+                image, metadata = entry
+                metadata["filepath"] = image_file
+                return Spim(image, metadata, stage,
+                            cached=False, predecessors=dict())
+        return None
+
+    def record(self, image_file, spim):
+        """Store a Spim, if its stage is cached"""
+        if spim.stage in self.fingerprints:
+            self.cache.put(self.fingerprints[spim.stage],
+                           self._content_hash(image_file),
+                           (spim._image, dict(spim.metadata)))
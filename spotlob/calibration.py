@@ -33,6 +33,13 @@ class Calibration(object):
 
             self.pxPerMicron = float(caldict[microscope_name][objective])
 
+    def scaled(self, scale):
+        """The calibration of an image, that has been scaled by a factor,
+        for example read at a reduced resolution"""
+        if scale == 1:
+            return self
+        return Calibration(self.pxPerMicron * scale)
+
     def pixel_to_micron(self, pixels):
         return pixels / self.pxPerMicron
 
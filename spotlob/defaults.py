@@ -150,9 +150,10 @@ def load_image(filepath, cached=False):
     ----------
     filepath : str
         Path to the image file
-    cached : bool
+    cached : bool or RetentionPolicy
         Wether or not references to previous Spim should be kept
-        when processing this spim to newer versions
+        when processing this spim to newer versions, see
+        :class:`~spotlob.retention.RetentionPolicy`
 
     RETURNS
     -------
@@ -0,0 +1,198 @@
+"""
+Sequences of process steps, that can be applied together in a single pass,
+instead of one after another. Every process step allocates a new image and
+reads the whole image of the previous step, which takes a considerable
+part of the processing time for large images.
+
+A :class:`~spotlob.pipeline.Pipeline` applies a fused sequence, whenever
+its processes allow it and the intermediate Spims are not needed, that is
+for Spims that are not cached and when no hooks are added. To apply every
+process on its own, set `fuse_steps` to False
+
+.. code-block:: python
+
+    pipeline.fuse_steps = False
+"""
+import math
+
+import cv2
+import numpy as np
+
+from .process_opencv import SimpleReader, GreyscaleConverter,\
+    GaussianPreprocess, BinaryThreshold, OtsuThreshold
+from .spim import Spim, SpimStage
+
+
+class FusedBinarization(object):
+    """Applies a :class:`~spotlob.process_opencv.GreyscaleConverter`, a
+    :class:`~spotlob.process_opencv.GaussianPreprocess` and a
+    :class:`~spotlob.process_opencv.BinaryThreshold` or
+    :class:`~spotlob.process_opencv.OtsuThreshold` together, with the same
+    result as applying them one after another.
+
+    The greyscale image is computed into a new array, which is then blurred
+    and thresholded in place. The inversion of the converter is included
+    in the threshold, except for blurs with an even kernel size, whose
+    rounding depends on the order.
+
+    If a :class:`~spotlob.process_opencv.SimpleReader` is included, the
+    greyscale image is computed directly from the image in the BGR order
+    of OpenCV, without converting it to RGB first.
+    """
+
+    output_stage = SpimStage.binarized
+
+    def __init__(self, converter, preprocessor, binarization, reader=None):
+        self.reader = reader
+        self.converter = converter
+        self.preprocessor = preprocessor
+        self.binarization = binarization
+
+    @classmethod
+    def from_pipeline(cls, pipeline, stage=SpimStage.loaded):
+        """The fused processes of a pipeline, or None if its processes can
+        not be fused
+
+        Parameters
+        ----------
+        pipeline : Pipeline
+            the pipeline
+        stage : int, optional
+            SpimStage to start at, `loaded` or `new` to include the reader
+
+        Returns
+        -------
+        FusedBinarization or None
+            the fused processes
+        """
+        if stage not in (SpimStage.new, SpimStage.loaded):
+            return None
+        processes = [pipeline.process_stage_dict.get(st)
+                     for st in range(stage, SpimStage.binarized)]
+        if stage == SpimStage.new:
+            reader = processes.pop(0)
+            if type(reader) is not SimpleReader:
+                return None
+        else:
+            reader = None
+
+        # subclasses might behave differently
+        if [type(p) for p in processes[:2]] != [GreyscaleConverter,
+                                                GaussianPreprocess] or \
+                type(processes[2]) not in (BinaryThreshold, OtsuThreshold):
+            return None
+        return cls(*processes, reader=reader)
+
+    @property
+    def input_stage(self):
+        if self.reader is None:
+            return SpimStage.loaded
+        return SpimStage.new
+
+    @property
+    def processes(self):
+        processes = [self.converter, self.preprocessor, self.binarization]
+        if self.reader is not None:
+            processes.insert(0, self.reader)
+        return processes
+
+    def _grey(self, color_image, conversion, bgr=False):
+        if conversion == "Grey":
+            code = cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY
+            return cv2.cvtColor(color_image, code)
+        elif conversion in self.converter.hsv_str_list:
+            code = cv2.COLOR_BGR2HSV if bgr else cv2.COLOR_RGB2HSV
+            hsv = cv2.cvtColor(color_image, code)
+            return cv2.extractChannel(
+                hsv, self.converter.hsv_str_list.index(conversion))
+        else:
+            channel = self.converter.rgb_str_list.index(conversion)
+            return cv2.extractChannel(color_image,
+                                      2 - channel if bgr else channel)
+
+    def apply(self, color_image, bgr=False):
+        """Convert, preprocess and binarize an image
+
+        Parameters
+        ----------
+        color_image : numpy.ndarray
+            the image at stage `loaded`
+        bgr : bool, optional
+            if the image is in BGR order, as read by OpenCV, instead of RGB
+
+        Returns
+        -------
+        numpy.ndarray
+            the binary image
+        """
+        if color_image.dtype != np.uint8 or color_image.ndim != 3:
+            # only 8 bit color images are converted without a copy
+            image = color_image
+            if bgr:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            for process in self.processes[-3:]:
+                image = process.apply(image)
+            return image
+
+        parameters = self.converter.parameters.to_dict()
+        invert = parameters["invert"]
+        grey = self._grey(color_image, parameters["conversion"], bgr)
+
+        kernelsize = self.preprocessor.parameters["kernelsize"].value
+        if invert and kernelsize % 2 == 0:
+            # the mean of an even kernel can end on .5, which is rounded to
+            # even, so inverting after the blur would not give the same image
+            cv2.bitwise_not(grey, dst=grey)
+            invert = False
+
+        # returns the same array, if the kernel has size 1
+        grey = self.preprocessor.apply(grey)
+
+        if isinstance(self.binarization, BinaryThreshold):
+            threshold = self.binarization.parameters["threshold"].value
+            if invert:
+                # 255 - x > t is x <= 254 - t, cv2 uses the floor of t
+                cv2.threshold(grey, 254 - math.floor(threshold), 255,
+                              cv2.THRESH_BINARY_INV, dst=grey)
+            else:
+                cv2.threshold(grey, threshold, 255, cv2.THRESH_BINARY,
+                              dst=grey)
+        else:
+            if invert:
+                cv2.bitwise_not(grey, dst=grey)
+            cv2.threshold(grey, 0, 255, cv2.THRESH_OTSU, dst=grey)
+
+        for process in self.processes:
+            process.outdated = False
+        return grey
+
+    def apply_to_spim(self, spim):
+        """Apply onto a Spim at the input stage, that is not cached
+
+        Parameters
+        ----------
+        spim : Spim
+            the Spim at stage `loaded`, or `new` if the reader is included
+
+        Returns
+        -------
+        Spim
+            the Spim at stage `binarized`, without predecessors
+        """
+        assert spim.stage == self.input_stage and not spim.cached
+        if self.reader is None:
+            return Spim(self.apply(spim.image),
+                        spim.metadata.copy(),
+                        self.output_stage,
+                        spim.cached,
+                        dict())
+
+        bgr_image, metadata = self.reader.read_bgr(
+            spim.metadata["filepath"], **self.reader.parameters.to_dict())
+        self.reader.outdated = False
+        metadata.update(spim.metadata)
+        return Spim(self.apply(bgr_image, bgr=True),
+                    metadata,
+                    self.output_stage,
+                    spim.cached,
+                    dict())
@@ -0,0 +1,137 @@
+"""
+Collect timing information about a batch process, to find out which
+process step takes the most time on real data.
+
+For every image, the wall time of every process step is recorded,
+together with the size of the image file, the size of the loaded image
+and the number of features found. The records can be evaluated image by
+image or summarized per process step.
+
+.. code-block:: python
+
+    from spotlob.batch import batchprocess
+    from spotlob.instrumentation import BatchStatistics
+
+    stats = BatchStatistics()
+    results = batchprocess("my_pipe.pipe", image_files, statistics=stats)
+
+    print(stats.images_per_second())
+    print(stats.summary())
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+# names of the Spim methods, indexed by the stage they are applied at
+STEP_NAMES = ["read",
+              "convert",
+              "preprocess",
+              "binarize",
+              "postprocess",
+              "extract_features",
+              "filter_features",
+              "analyze",
+              "store"]
+
+
+def step_column(stage):
+    """Name of the column that holds the time of the process step applied
+    at `stage`"""
+    return STEP_NAMES[stage] + "_s"
+
+
+class BatchStatistics(object):
+    """Collects the timing records of all images of a batch"""
+
+    def __init__(self, progress_callback=None):
+        """
+        Parameters
+        ----------
+        progress_callback : callable, optional
+            called with this BatchStatistics object, whenever the record
+            of another image has been added
+        """
+        self.progress_callback = progress_callback
+        self.records = []
+        self.start_time = None
+        self.last_time = None
+
+    def start(self):
+        """Start measuring the throughput, called at the start of a batch"""
+        self.start_time = time.perf_counter()
+
+    def add(self, record):
+        """Add the timing record of a single image
+
+        Parameters
+        ----------
+        record : dict
+            timing and size information of an image
+        """
+        if self.start_time is None:
+            self.start()
+        self.records.append(record)
+        self.last_time = time.perf_counter()
+
+        if self.progress_callback is not None:
+            self.progress_callback(self)
+
+    @property
+    def n_images(self):
+        return len(self.records)
+
+    def images_per_second(self):
+        """Number of images finished per second of wall time, since the
+        start of the batch"""
+        if self.n_images == 0:
+            return 0.
+        return self.n_images / (self.last_time - self.start_time)
+
+    def per_image(self):
+        """All records, one row per image
+
+        Returns
+        -------
+        pandas.Dataframe
+            with the columns `filepath`, `file_bytes`, `image_bytes`,
+            `n_features_extracted`, `n_features_filtered`, the times in
+            seconds of every process step as `<step>_s`, the time of
+            `get_data_s` and the sum of all as `total_s`
+        """
+        return pd.DataFrame(self.records)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Statistics of the time spent in every process step
+
+        Parameters
+        ----------
+        percentiles : tuple of float, optional
+            percentiles of the times to calculate, by default 50, 90 and 99
+
+        Returns
+        -------
+        pandas.Dataframe
+            one row per process step, with the number of images, the mean
+            time, the given percentiles and the total time in seconds and
+            the share of the step in the total time of all steps
+        """
+        per_image = self.per_image()
+        step_columns = [c for c in per_image.columns
+                        if c.endswith("_s") and c != "total_s"]
+        total = per_image[step_columns].sum().sum() if step_columns else 0.
+
+        rows = []
+        for column in step_columns:
+            times = per_image[column].dropna().values
+            row = {"step": column[:-2],
+                   "count": len(times),
+                   "mean_s": np.mean(times)}
+            for p in percentiles:
+                row["p%s_s" % p] = np.percentile(times, p)
+            row["total_s"] = np.sum(times)
+            row["share"] = row["total_s"] / total if total > 0 else np.nan
+            rows.append(row)
+
+        return pd.DataFrame(rows).set_index("step") if rows \
+            else pd.DataFrame(rows)
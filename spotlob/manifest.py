@@ -0,0 +1,143 @@
+"""
+Keep track of the progress of a batch process on disk, so that an
+interrupted batch can be resumed, without processing the images again
+that have already been finished.
+
+The progress is stored in two files: the manifest itself, with one line
+of json per finished image, and next to it a file with the pickled
+results, that the lines of the manifest point to.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+
+def file_hash(filepath):
+    """sha1 hexdigest of the content of a file"""
+    sha = hashlib.sha1()
+    with open(filepath, "rb") as f_:
+        for block in iter(lambda: f_.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ProgressManifest(object):
+    """A manifest of the images that have been finished in a batch
+    process. Every image is identified by its filepath, size and
+    modification time, together with the identity of the pipeline that it
+    has been processed with. If any of these change, the image is
+    processed again.
+    """
+
+    def __init__(self, manifest_path, pipeline_id):
+        """
+        Parameters
+        ----------
+        manifest_path : str
+            path of the manifest file. The results are stored next to it,
+            with an additional `.results` extension
+        pipeline_id : str
+            identifies the pipeline, for example the hash of the pipeline
+            file
+        """
+        self.manifest_path = manifest_path
+        self.results_path = manifest_path + ".results"
+        self.pipeline_id = pipeline_id
+        self._entries = dict()
+
+        if os.path.exists(self.manifest_path):
+            self._load()
+
+        self._manifest_file = None
+        self._results_file = None
+
+    @classmethod
+    def for_pipeline_file(cls, manifest_path, pipeline_file):
+        """Create a manifest for a batch with the pipeline stored in
+        `pipeline_file`, that is identified by the hash of the file"""
+        return cls(manifest_path, file_hash(pipeline_file))
+
+    def _load(self):
+        with open(self.manifest_path, "r") as f_:
+            for line in f_:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # line has not been written completely
+                    continue
+                self._entries[entry["key"]] = entry
+
+    def _key(self, image_file):
+        stat = os.stat(image_file)
+        return "%s|%s|%s|%s" % (os.path.abspath(image_file),
+                                stat.st_size,
+                                stat.st_mtime_ns,
+                                self.pipeline_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def finished(self, image_file):
+        """True if the image has been finished with the same pipeline
+        and has not been modified since. Files, that can not be accessed,
+        are not finished, so the error is raised when they are processed"""
+        try:
+            return self._key(image_file) in self._entries
+        except OSError:
+            return False
+
+    def load_result(self, image_file):
+        """Get the stored result of a finished image
+
+        Returns
+        -------
+        pandas.Dataframe
+            result as returned by :meth:`Spim.get_data`
+        """
+        entry = self._entries[self._key(image_file)]
+        with open(self.results_path, "rb") as f_:
+            f_.seek(entry["offset"])
+            return pickle.loads(f_.read(entry["length"]))
+
+    def record(self, image_file, result):
+        """Store the result of an image and mark it as finished"""
+        if self._manifest_file is None:
+            self._open()
+
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self._results_file.tell()
+        self._results_file.write(data)
+        self._results_file.flush()
+
+        # the manifest line is written after the results, so a manifest
+        # entry always points to complete results
+        entry = {"key": self._key(image_file),
+                 "filepath": image_file,
+                 "offset": offset,
+                 "length": len(data)}
+        self._manifest_file.write(json.dumps(entry) + "\n")
+        self._manifest_file.flush()
+        self._entries[entry["key"]] = entry
+
+    def _open(self):
+        incomplete_line = False
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "rb") as f_:
+                f_.seek(0, os.SEEK_END)
+                if f_.tell() > 0:
+                    f_.seek(-1, os.SEEK_END)
+                    incomplete_line = f_.read(1) != b"\n"
+
+        self._results_file = open(self.results_path, "ab")
+        self._manifest_file = open(self.manifest_path, "a")
+        if incomplete_line:
+            # terminate the line, that has been left incomplete
+            self._manifest_file.write("\n")
+
+    def close(self):
+        if self._manifest_file is not None:
+            self._manifest_file.close()
+            self._results_file.close()
+            self._manifest_file = None
+            self._results_file = None
@@ -3,11 +3,85 @@ Store results and images from a detection into files
 """
 import os.path
 
+import numpy as np
+import pandas as pd
 from PIL import Image
 
 from .spim import Spim, SpimStage
 from .process_opencv import draw_contours
 
+# columns, that can not be stored in a table
+DROP_COLUMNS = ("contours",)
+
+# columns, that hold arrays of a different length for every row
+LIST_COLUMNS = ("distances_hist", "distances_bin_edges_px")
+
+
+def _is_array(value):
+    return isinstance(value, (np.ndarray, tuple, list))
+
+
+def expand_array_columns(dataframe,
+                         drop_columns=DROP_COLUMNS,
+                         list_columns=LIST_COLUMNS):
+    """Turn columns, that contain an array in every row, like
+    `ellipse_position_px` or `line_start`, into one numeric column for
+    every element of the arrays. The new columns are named after the
+    original one, with the index of the element appended, like
+    `ellipse_position_px_0` and `ellipse_position_px_1`.
+
+    Parameters
+    ----------
+    dataframe : pandas.Dataframe
+        results, as returned by :meth:`Spim.get_data`
+    drop_columns : tuple of str, optional
+        columns to remove, by default `contours`
+    list_columns : tuple of str, optional
+        columns, that contain arrays of varying length. They are not
+        expanded, but every array is flattened to a list
+
+    Returns
+    -------
+    pandas.Dataframe
+        dataframe with only scalar values, except for the list columns
+    """
+    out = dataframe.drop(columns=[c for c in drop_columns
+                                  if c in dataframe.columns])
+    if len(out) == 0:
+        return out
+
+    expanded = []
+    for column in out.columns:
+        values = out[column].values
+        if out[column].dtype != object or \
+                not all(_is_array(v) for v in values):
+            expanded.append(out[[column]])
+        elif column in list_columns:
+            expanded.append(pd.DataFrame(
+                {column: [np.ravel(v).tolist() for v in values]},
+                index=out.index))
+        else:
+            arrays = np.array([np.ravel(v) for v in values])
+            if arrays.ndim != 2:
+                raise ValueError("Column %s contains arrays of different "
+                                 "lengths, it must be given in list_columns"
+                                 % column)
+            names = ["%s_%i" % (column, i) for i in range(arrays.shape[1])]
+            expanded.append(pd.DataFrame(arrays,
+                                         index=out.index,
+                                         columns=names))
+    return pd.concat(expanded, axis=1)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Writing parquet files requires pyarrow, "
+                          "install it with `pip install pyarrow`")
+    return pyarrow
+
 
 class Writer(object):
     def __init__(self, image_filepath, data_filepath):
@@ -25,4 +99,125 @@ class Writer(object):
 
         if ext == ".csv":
             dataframe.to_csv(self.data_filepath)
+        elif ext == ".parquet":
+            with ParquetSink(self.data_filepath) as sink:
+                sink.write(dataframe)
         return self.data_filepath
+
+
+class ParquetSink(object):
+    """Appends the results of many images to a single parquet file,
+    without keeping them all in memory. The rows are collected until
+    `row_group_size` rows are buffered, which are then written to the
+    file as one row group. Columns that hold arrays are expanded into
+    numeric columns, see :func:`expand_array_columns`.
+
+    The columns of the file are fixed by the first row group, so
+    all results need to have the same columns.
+
+    Requires `pyarrow`.
+
+    Example
+    -------
+
+    .. code-block:: python
+
+        from spotlob.batch import batchprocess_iter
+        from spotlob.output import ParquetSink
+
+        with ParquetSink("results.parquet") as sink:
+            for image_result in batchprocess_iter("my_pipe.pipe",
+                                                  image_files):
+                sink.write(image_result)
+
+        results = pandas.read_parquet("results.parquet")
+    """
+
+    def __init__(self,
+                 filepath,
+                 row_group_size=65536,
+                 drop_columns=DROP_COLUMNS,
+                 list_columns=LIST_COLUMNS,
+                 compression="snappy"):
+        """
+        Parameters
+        ----------
+        filepath : str
+            path of the parquet file to create
+        row_group_size : int, optional
+            number of rows, that are written at once
+        drop_columns : tuple of str, optional
+            columns, that are not stored, by default `contours`
+        list_columns : tuple of str, optional
+            columns that contain arrays of varying length, to be stored
+            as lists
+        compression : str, optional
+            compression codec of the parquet file, by default "snappy"
+        """
+        self._pa = _import_pyarrow()
+        self.filepath = filepath
+        self.row_group_size = row_group_size
+        self.drop_columns = drop_columns
+        self.list_columns = list_columns
+        self.compression = compression
+
+        self._buffer = []
+        self._buffered_rows = 0
+        self._writer = None
+        self._schema = None
+
+    def write(self, dataframe):
+        """Append the rows of a dataframe, for example the results of
+        one image
+
+        Parameters
+        ----------
+        dataframe : pandas.Dataframe
+            results, as returned by :meth:`Spim.get_data`
+        """
+        if len(dataframe) == 0:
+            return
+        self._buffer.append(expand_array_columns(dataframe,
+                                                 self.drop_columns,
+                                                 self.list_columns))
+        self._buffered_rows += len(dataframe)
+        if self._buffered_rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows to the file"""
+        if not self._buffer:
+            return
+
+        rows = pd.concat(self._buffer, ignore_index=True)
+        self._buffer = []
+        self._buffered_rows = 0
+
+        if self._writer is None:
+            table = self._pa.Table.from_pandas(rows, preserve_index=False)
+            self._schema = table.schema
+            self._writer = self._pa.parquet.ParquetWriter(
+                self.filepath, self._schema, compression=self.compression)
+        else:
+            unknown = set(rows.columns) - set(self._schema.names)
+            if unknown:
+                raise ValueError("Columns %s are not in the parquet file"
+                                 % ", ".join(sorted(unknown)))
+            rows = rows.reindex(columns=self._schema.names)
+            table = self._pa.Table.from_pandas(rows,
+                                               schema=self._schema,
+                                               preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        """Write the remaining rows and close the file"""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -4,8 +4,113 @@ to be applied one after another onto a spim, to automate a
 detection task consisting of multiple process steps.
 """
 
+import hashlib
+import json
+import time
+
 import dill
 
+from .fusion import FusedBinarization
+from .serialization import pipeline_description, \
+    processes_from_description
+from .spim import LazySpim, SpimStage
+
+
+def _simple_state(value):
+    # a json serializable description of an attribute value
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, (list, tuple)):
+        return [_simple_state(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((str(k), _simple_state(v)) for k, v in value.items())
+    elif hasattr(value, "__dict__"):
+        return [type(value).__name__,
+                dict((k, _simple_state(v)) for k, v in vars(value).items()
+                     if not k.startswith("_"))]
+    else:
+        return repr(type(value))
+
+
+def process_signature(process):
+    """Describes what a process does: its class, the function it applies,
+    its parameter values and further public attributes, like the
+    calibration of an analysis. Transient state like the `outdated` flag
+    or private caches is not part of the signature.
+
+    Parameters
+    ----------
+    process : SpotlobProcessStep
+        the process to describe
+
+    Returns
+    -------
+    list
+        json serializable description of the process
+    """
+    process_class = type(process)
+    state = dict((name, _simple_state(value))
+                 for name, value in vars(process).items()
+                 if not name.startswith("_") and
+                 name not in ("outdated", "function", "parameters"))
+    function_name = getattr(process.function, "__qualname__", None)
+    return [process_class.__module__ + "." + process_class.__qualname__,
+            function_name,
+            _simple_state(process.parameters.to_dict()),
+            state]
+
+
+def _output_bytes(spim):
+    # size of the image or contours, that a process step has created
+    if spim._image is not None:
+        return spim._image.nbytes
+    elif spim.stage in (SpimStage.features_extracted,
+                        SpimStage.features_filtered):
+        return sum(c.nbytes for c in spim.metadata["contours"])
+    return 0
+
+
+class PipelineHook(object):
+    """Base class for hooks, that are called before and after every process
+    step a pipeline applies, for example to measure time or memory.
+    Subclasses override one or both methods.
+    """
+
+    def before_step(self, stage, process, spim):
+        """Called before a process is applied
+
+        Parameters
+        ----------
+        stage : int
+            SpimStage, at which the process is applied
+        process : SpotlobProcessStep
+            the process, that is applied
+        spim : Spim
+            the input of the process
+        """
+        pass
+
+    def after_step(self, stage, process, spim, output_spim, elapsed,
+                   output_bytes):
+        """Called after a process has been applied
+
+        Parameters
+        ----------
+        stage : int
+            SpimStage, at which the process has been applied
+        process : SpotlobProcessStep
+            the process, that has been applied
+        spim : Spim
+            the input of the process
+        output_spim : Spim
+            the output of the process, at stage `stage + 1`
+        elapsed : float
+            wall time of the process in seconds
+        output_bytes : int
+            size of the image or contours, that the process has created
+        """
+        pass
+
 
 class Pipeline(object):
     """A pipeline is a sequence of processes, that can be applied one after
@@ -16,9 +121,36 @@ class Pipeline(object):
     method.
     """
 
+    # hooks, called before and after every process step
+    hooks = ()
+
+    # apply sequences of processes together, where possible,
+    # see spotlob.fusion
+    fuse_steps = True
+
     def __init__(self, processes):
         self.process_stage_dict = dict([(p.input_stage, p) for p in processes])
 
+    def add_hook(self, hook):
+        """Call a hook before and after every process step, that this
+        pipeline applies. Hooks are not stored with the pipeline.
+
+        Parameters
+        ----------
+        hook : PipelineHook
+            the hook to add
+        """
+        self.hooks = list(self.hooks) + [hook]
+
+    def remove_hook(self, hook):
+        """Stop calling a hook, that has been added with `add_hook`"""
+        self.hooks = [h for h in self.hooks if h is not hook]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("hooks", None)
+        return state
+
     @property
     def processes(self):
         return self.process_stage_dict.values()
@@ -44,7 +176,7 @@ class Pipeline(object):
         return Pipeline(new_dict.values())
 
     def apply_from_stage_to_stage(self, spim, from_stage, to_stage):
-        """Recursively applies the pipeline-processes from a given stage up to
+        """Applies the pipeline-processes from a given stage up to
         another given stage.
 
         Parameters
@@ -67,18 +199,92 @@ class Pipeline(object):
             If to_stage is before from_stage
 
         """
-        if from_stage == to_stage:
-            return spim
-        elif from_stage > to_stage:
-            # return self.apply_from_stage_to_stage(spim, to_stage, from_stage)
+        if from_stage > to_stage:
             raise Exception("invalid apply request")
-        else:
-            # recursive
-            intermediate_spim = self.apply_from_stage_to_stage(
-                spim, from_stage, to_stage-1)
-            last_process = self.process_stage_dict[to_stage-1]
-            outspim = intermediate_spim.do_process_at_stage(last_process)
-            return outspim
+
+        stage = from_stage
+        while stage < to_stage:
+            fused = self._fused_steps(spim, stage, to_stage)
+            if fused is not None:
+                spim = fused.apply_to_spim(spim)
+                stage = fused.output_stage
+                continue
+
+            process = self.process_stage_dict[stage]
+            if self.hooks:
+                spim = self._apply_with_hooks(spim, stage, process)
+            else:
+                spim = spim.do_process_at_stage(process)
+            stage += 1
+        return spim
+
+    def _fused_steps(self, spim, stage, to_stage):
+        # the fused processes, that can be applied at this stage, if the
+        # intermediate spims are not needed
+        if not self.fuse_steps or self.hooks or spim.cached or \
+                spim.stage != stage or \
+                to_stage < FusedBinarization.output_stage:
+            return None
+        return FusedBinarization.from_pipeline(self, stage)
+
+    def _apply_with_hooks(self, spim, stage, process):
+        for hook in self.hooks:
+            hook.before_step(stage, process, spim)
+
+        start = time.perf_counter()
+        outspim = spim.do_process_at_stage(process)
+        elapsed = time.perf_counter() - start
+
+        output_bytes = _output_bytes(outspim)
+        for hook in self.hooks:
+            hook.after_step(stage, process, spim, outspim, elapsed,
+                            output_bytes)
+        return outspim
+
+    def fingerprint(self, up_to_stage=None):
+        """A hash, that identifies the processes and their parameter values.
+        Two pipelines with the same fingerprint produce the same results.
+
+        Parameters
+        ----------
+        up_to_stage : int, optional
+            if given, only the processes applied before this SpimStage are
+            considered, i.e. the fingerprint identifies the Spim at this
+            stage
+
+        Returns
+        -------
+        str
+            hexdigest of the hash
+        """
+        signatures = [[stage, process_signature(process)]
+                      for stage, process
+                      in sorted(self.process_stage_dict.items())
+                      if up_to_stage is None or stage < up_to_stage]
+        serialized = json.dumps(signatures, sort_keys=True)
+        return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+    def apply_lazy(self, filepath, stage=None, cached=True):
+        """Apply the pipeline lazily: the processes are applied only when
+        the image, the metadata or the results are requested, and only
+        those that are needed for it.
+
+        Parameters
+        ----------
+        filepath : str
+            path of the image file
+        stage : int, optional
+            SpimStage of the returned Spim, by default the stage after the
+            last process
+        cached : bool or RetentionPolicy, optional
+            passed on to the Spim, by default True
+
+        Returns
+        -------
+        LazySpim
+            a Spim, that is computed on demand
+        """
+        return LazySpim(filepath, self, stage, cached)
 
     def _maxstage(self):
         return max(self.process_stage_dict.keys())+1
@@ -158,7 +364,7 @@ class Pipeline(object):
         else:
             return spim.get_at_stage(up_to_stage)
 
-    def save(self, target_path):
+    def save(self, target_path, format="json"):
         """Store the pipeline including process paramaters for
         later use.
 
@@ -166,6 +372,11 @@ class Pipeline(object):
         ----------
         target_path : str
             path of the file to store the pipeline to
+        format : str, optional
+            "json" (default) stores the class and parameter values of
+            every process, see :mod:`~spotlob.serialization`. Processes,
+            that can not be described like this, are pickled with dill.
+            "dill" pickles the whole pipeline
 
         Notes
         -----
@@ -178,12 +389,19 @@ class Pipeline(object):
             Use `Pipeline.from_file` to restore the pipeline object
             from storage
         """
-        with open(target_path, "wb") as dill_file:
-            dill.dump(self, dill_file)
+        if format == "json":
+            with open(target_path, "w") as json_file:
+                json.dump(pipeline_description(self), json_file, indent=1)
+        elif format == "dill":
+            with open(target_path, "wb") as dill_file:
+                dill.dump(self, dill_file)
+        else:
+            raise ValueError("Unknown format %s, use json or dill" % format)
 
     @classmethod
     def from_file(cls, filepath):
-        """Restore a pipeline from a file
+        """Restore a pipeline from a file, that has been stored in either
+        format, see :meth:`Pipeline.save`
 
         Parameters
         ----------
@@ -196,9 +414,15 @@ class Pipeline(object):
             the restored pipeline object
         """
 
-        with open(filepath, "rb") as dill_file:
-            restored_pipe = dill.load(dill_file)
-        return restored_pipe
+        with open(filepath, "rb") as pipe_file:
+            content = pipe_file.read()
+
+        if content.lstrip().startswith(b"{"):
+            description = json.loads(content.decode("utf-8"))
+            return cls(processes_from_description(description))
+
+        # stored with format="dill" or an earlier version of spotlob
+        return dill.loads(content)
 
     def __str__(self):
         out = []
@@ -1,8 +1,10 @@
+import collections
+import threading
+
 import cv2
 import pandas as pd
 import numpy as np
 import os
-from PIL import Image
 import tifffile as tf
 import imageio as im
 
@@ -10,71 +12,207 @@ from .process_steps import Reader, Converter, Preprocessor,\
     Binarization, Postprocessor, FeatureFinder, FeatureFilter
 from .parameters import SpotlobParameterSet, EnumParameter,\
     BoolParameter, NumericRangeParameter
+from .spim import Spim, SpimStage
 
 
 class SimpleReader(Reader):
     """Reads an image from a file as an RGB file.
     Standard image formats, such as `png`, `jpg`, `tif` are supported.
     It uses `cv2.imread`.
+
+    With a `downscale` of 2, 4 or 8, the image is read at a reduced
+    resolution, for previews and quick screening. JPEG images are decoded
+    at the reduced size directly, which is several times faster. The
+    metadata contains the `scale` `1 / downscale`, analyses use it to
+    correct their calibration.
     """
 
+    # imread flags, by downscale factor
+    _reduced_flags = {2: cv2.IMREAD_REDUCED_COLOR_2,
+                      4: cv2.IMREAD_REDUCED_COLOR_4,
+                      8: cv2.IMREAD_REDUCED_COLOR_8}
+
     def __init__(self):
-        super(SimpleReader, self).__init__(self.fn_read, [])
+        pars = [EnumParameter("downscale", 1, [1, 2, 4, 8])]
+        super(SimpleReader, self).__init__(self.fn_read, pars)
 
-    def fn_read(self, filepath):
-        # load as color, convert from BGR to RGB
+    def read_bgr(self, filepath, downscale=1):
+        """Read the image in the BGR channel order of OpenCV, with the
+        metadata"""
         if os.path.exists(filepath):
-            return cv2.cvtColor(cv2.imread(filepath), cv2.COLOR_BGR2RGB), {}
+            metadata = {}
+            if downscale == 1:
+                bgr_image = cv2.imread(filepath)
+            else:
+                bgr_image = cv2.imread(filepath,
+                                       self._reduced_flags[downscale])
+            if bgr_image is None:
+                raise IOError("File %s could not be read as an image"
+                              % filepath)
+            if downscale != 1:
+                # a pixel is downscale times as large, the size is rounded
+                metadata["scale"] = 1 / downscale
+            return bgr_image, metadata
         else:
             raise IOError("File %s not found" % filepath)
 
+    def fn_read(self, filepath, downscale=1):
+        # load as color, convert from BGR to RGB
+        bgr_image, metadata = self.read_bgr(filepath, downscale)
+        # in place, the BGR image is not needed anymore
+        return cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB,
+                            dst=bgr_image), metadata
+
+def _read_tiff_region(page, x0, y0, x1, y1):
+    """Read a rectangular region of a tiff page. Uncompressed, contiguous
+    pages are memory-mapped, otherwise only the tiles or strips
+    intersecting the region are decoded.
+    """
+    if page.is_memmappable:
+        image = np.memmap(page.parent.filehandle.path,
+                          dtype=page.dtype,
+                          mode="r",
+                          offset=page.dataoffsets[0],
+                          shape=page.shape)
+        return image[y0:y1, x0:x1]
+
+    if page.imagedepth != 1 or \
+            (page.samplesperpixel > 1 and page.planarconfig != 1):
+        # separate color planes or volumes are decoded completely
+        return page.asarray()[y0:y1, x0:x1]
+
+    height, width = page.imagelength, page.imagewidth
+    if page.is_tiled:
+        seg_h, seg_w = page.tilelength, page.tilewidth
+    else:
+        seg_h, seg_w = min(page.rowsperstrip, height), width
+    segments_across = -(-width // seg_w)
+    indices = [row * segments_across + col
+               for row in range(y0 // seg_h, -(-y1 // seg_h))
+               for col in range(x0 // seg_w, -(-x1 // seg_w))]
+
+    decodeargs = {"_fullsize": page.is_tiled}
+    if page.compression in (6, 7, 34892, 33007):
+        # jpeg
+        decodeargs["jpegtables"] = page.jpegtables
+        decodeargs["jpegheader"] = page.keyframe.jpegheader
+
+    out = np.zeros((y1 - y0, x1 - x0) + page.shape[2:], dtype=page.dtype)
+    fh = page.parent.filehandle
+    # the segments are yielded with their position in the lists given
+    for data, i in fh.read_segments(
+            [page.dataoffsets[index] for index in indices],
+            [page.databytecounts[index] for index in indices]):
+        segment, (_, _, top, left, _), _ = page.decode(data, indices[i],
+                                                       **decodeargs)
+        if segment is None:
+            # empty segments are zero
+            continue
+        # segments are shaped (depth, length, width, samples)
+        segment = segment[0].reshape(segment.shape[1:3] + page.shape[2:])
+        sy0, sx0 = max(y0, top), max(x0, left)
+        sy1 = min(y1, top + segment.shape[0])
+        sx1 = min(x1, left + segment.shape[1])
+        out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = \
+            segment[sy0 - top:sy1 - top, sx0 - left:sx1 - left]
+    return out
+
+
+def _select_tiff_level(tif, width_percent, height_percent, max_pixels):
+    """The page of the largest resolution level of a pyramidal tiff, at
+    which the region of interest has at most `max_pixels` pixels, or of the
+    smallest level if there is none. Returns the page and its index"""
+    levels = [level.keyframe for level in tif.series[0].levels]
+    for i, page in enumerate(levels):
+        roi_pixels = page.imagewidth * width_percent / 100 * \
+            page.imagelength * height_percent / 100
+        if roi_pixels <= max_pixels:
+            return page, i
+    return levels[-1], len(levels) - 1
+
+
 class TifReader(Reader):
     """
     Reads an image from a file as an RGB file.
     Only image format `tif` is supported.
-    It uses `tifffile.memmap`.
+    It uses `tifffile`: only the tiles or strips of the region of interest
+    are read and decoded, uncompressed images are memory-mapped.
+
+    If `max_megapixels` is not 0 and the tiff contains downsampled
+    resolution levels, like whole slide images, the region of interest is
+    read from the largest level where it has at most `max_megapixels`
+    megapixels. The level and its `scale`, the ratio to the width of the
+    full resolution image, are added to the metadata. Analyses use the
+    `scale` to correct their calibration.
     """
 
     def __init__(self):
         pars = [NumericRangeParameter("width_percent", 100, 0, 100),
                 NumericRangeParameter("height_percent", 100, 0, 100),
                 NumericRangeParameter("x0_percent", 0, 0, 100),
-                NumericRangeParameter("y0_percent", 0, 0, 100)]
+                NumericRangeParameter("y0_percent", 0, 0, 100),
+                NumericRangeParameter("max_megapixels", 0, 0, 1000)]
         
         self._preview_image_cache = None
 
         super(TifReader, self).__init__(self.partial_read, pars)
 
+    @staticmethod
+    def _ROI_corners(w, h, width_percent, height_percent, x0, y0):
+        new_w = int(w * width_percent / 100)
+        new_h = int(h * height_percent / 100)
+        x0 = int(w * x0 / 100)
+        y0 =  int(h * y0 / 100)
+        x1 = x0 + new_w
+        y1 = y0 + new_h
+
+        return x0, y0, min(x1,w), min(y1,h)
+
     def _absolute_ROI_corners(self, filepath, width_percent, height_percent, x0, y0):
         
         if os.path.exists(filepath):
-            im = Image.open(filepath)
-            w, h = im.size
-            
-            new_w = int(w * width_percent / 100)
-            new_h = int(h * height_percent / 100)
-            x0 = int(w * x0 / 100)
-            y0 =  int(h * y0 / 100)
-            x1 = x0 + new_w
-            y1 = y0 + new_h
-
-            return x0, y0, min(x1,w), min(y1,h)
+            with tf.TiffFile(filepath) as tif:
+                page = tif.pages[0]
+                w, h = page.imagewidth, page.imagelength
+            return self._ROI_corners(w, h, width_percent, height_percent,
+                                     x0, y0)
         else:
             raise IOError(f"File {filepath} not found")
 
-    def partial_read(self, filepath, width_percent, height_percent, x0_percent, y0_percent): # -> tuple(np.ndarray, dict)
+    def partial_read(self, filepath, width_percent, height_percent, x0_percent, y0_percent, max_megapixels=0): # -> tuple(np.ndarray, dict)
         """
         Returns an array of a part of an .tif image.
         The arguments must be percentages, even the startingpoint is relative.
         Starting Point is the top-left corner.
+        The ROI in the metadata is given in pixels of the level, that has
+        been read.
         """
-        x0,y0, x1,y1 = self._absolute_ROI_corners(filepath, 
-                                                    width_percent, 
-                                                    height_percent, 
-                                                    x0_percent, 
-                                                    y0_percent)
-        
-        return tf.memmap(filepath, dtype= np.uint8)[y0:y1, x0:x1, :], {"ROI": (x0,y0,x1,y1)}
+        if not os.path.exists(filepath):
+            raise IOError(f"File {filepath} not found")
+
+        # the header is read once, for the size and the layout
+        with tf.TiffFile(filepath) as tif:
+            page = tif.pages[0]
+            metadata = {}
+            if max_megapixels > 0:
+                full_width = page.imagewidth
+                page, level = _select_tiff_level(tif,
+                                                 width_percent,
+                                                 height_percent,
+                                                 max_megapixels * 1e6)
+                metadata["pyramid_level"] = level
+                metadata["scale"] = page.imagewidth / full_width
+
+            x0,y0, x1,y1 = self._ROI_corners(page.imagewidth,
+                                             page.imagelength,
+                                             width_percent, 
+                                             height_percent, 
+                                             x0_percent, 
+                                             y0_percent)
+            image = _read_tiff_region(page, x0, y0, x1, y1)
+
+        metadata["ROI"] = (x0,y0,x1,y1)
+        return image, metadata
     
     def preview(self, spim):
         filepath = spim.metadata["filepath"]
@@ -101,6 +239,189 @@ class TifReader(Reader):
         
         return image
 
+# offsets of the pages of the most recently read multi-page tiffs, by path,
+# modification time and size, so a frame is read without walking through
+# the pages before it
+_tiff_page_offsets = collections.OrderedDict()
+_tiff_page_offsets_lock = threading.Lock()
+_MAX_TIFF_PAGE_OFFSETS = 16
+
+
+def _tiff_offsets(tif, filepath):
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+    with _tiff_page_offsets_lock:
+        offsets = _tiff_page_offsets.get(key)
+        if offsets is not None:
+            _tiff_page_offsets.move_to_end(key)
+            return offsets
+
+    offsets = [page.offset for page in tif.pages]
+    with _tiff_page_offsets_lock:
+        _tiff_page_offsets[key] = offsets
+        while len(_tiff_page_offsets) > _MAX_TIFF_PAGE_OFFSETS:
+            _tiff_page_offsets.popitem(last=False)
+    return offsets
+
+
+def _tiff_page(tif, filepath, frame):
+    """A page of a tiff, read directly at its offset"""
+    offsets = _tiff_offsets(tif, filepath)
+    if not 0 <= frame < len(offsets):
+        raise IndexError("%s has no frame %i" % (filepath, frame))
+    tif.filehandle.seek(offsets[frame])
+    return tf.TiffPage(tif, index=frame)
+
+
+def _video_frame_count(capture):
+    """Number of frames of a video. The number in the header of the
+    container is only an estimate for many formats, so it is checked at
+    the end of the video, and the frames are counted if it is too large"""
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    if n_frames > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, n_frames - 1)
+        if capture.grab():
+            while capture.grab():
+                n_frames += 1
+            return n_frames
+
+    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    n_frames = 0
+    while capture.grab():
+        n_frames += 1
+    return n_frames
+
+
+def _timestamp(frame, fps):
+    # time of a video frame in seconds, or None if the rate is unknown
+    if fps > 0:
+        return frame / fps
+    return None
+
+
+class StackReader(Reader):
+    """Reads single frames of a stack of images, which is a multi-page
+    `tif` file or a video, like `avi` or `mp4`. The frame to read is given
+    as `frame` in the metadata of the Spim, see :meth:`Spim.from_file`, and
+    the time of a video frame is added as `timestamp_s`.
+
+    Tiffs are read with `tifffile`, videos with `cv2.VideoCapture`. Only
+    the requested frame is read, so stacks larger than the memory can be
+    processed, and the frames can be processed in parallel, see
+    :func:`~spotlob.batch.batchprocess`. To process all frames of a stack
+    in sequence, :meth:`StackReader.iter_frames` is faster for videos,
+    as it avoids seeking.
+
+    The offsets of the pages of a tiff are looked up once per process and
+    kept for the 16 most recently read files. The timestamp of a video
+    frame is None, if the video does not state its frame rate.
+    """
+
+    tiff_extensions = (".tif", ".tiff")
+
+    def __init__(self):
+        super(StackReader, self).__init__(self.read_frame, [])
+
+    def _is_tiff(self, filepath):
+        return filepath.lower().endswith(self.tiff_extensions)
+
+    def _open_video(self, filepath):
+        capture = cv2.VideoCapture(filepath)
+        if not capture.isOpened():
+            raise IOError("File %s could not be read as a video" % filepath)
+        return capture
+
+    @staticmethod
+    def _as_rgb(image):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        return image
+
+    def frame_count(self, filepath):
+        """Number of frames in a stack. For videos, the number stated by
+        the container is checked by reading at its end, and the frames
+        are counted if it is too large"""
+        if not os.path.exists(filepath):
+            raise IOError("File %s not found" % filepath)
+        if self._is_tiff(filepath):
+            with tf.TiffFile(filepath) as tif:
+                return len(_tiff_offsets(tif, filepath))
+        capture = self._open_video(filepath)
+        try:
+            return _video_frame_count(capture)
+        finally:
+            capture.release()
+
+    def read_frame(self, filepath, frame=0):
+        if not os.path.exists(filepath):
+            raise IOError("File %s not found" % filepath)
+        if self._is_tiff(filepath):
+            with tf.TiffFile(filepath) as tif:
+                page = _tiff_page(tif, filepath, frame)
+                return self._as_rgb(page.asarray()), {"frame": frame}
+
+        capture = self._open_video(filepath)
+        try:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            ok, bgr_image = capture.read()
+            if not ok:
+                raise IOError("Frame %i of %s could not be read"
+                              % (frame, filepath))
+            fps = capture.get(cv2.CAP_PROP_FPS)
+        finally:
+            capture.release()
+        return cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB, dst=bgr_image), \
+            {"frame": frame, "timestamp_s": _timestamp(frame, fps)}
+
+    def iter_frames(self, filepath, cached=False):
+        """Read all frames of a stack one after another, without loading
+        the whole stack into memory
+
+        Parameters
+        ----------
+        filepath : str
+            path of the multi-page tiff or the video
+        cached : bool or RetentionPolicy, optional
+            passed to every Spim, see :meth:`Spim.from_file`
+
+        Yields
+        ------
+        Spim
+            every frame, at stage `loaded`, as if read with :meth:`Spim.read`
+        """
+        def loaded(image, metadata):
+            new = Spim.from_file(filepath, cached, metadata["frame"])
+            metadata.update(new.metadata)
+            metadata["image_shape"] = image.shape
+            return Spim(image, metadata, SpimStage.loaded, cached,
+                        new._predecessors_and_self(), new._recipe_of(self))
+
+        if not os.path.exists(filepath):
+            raise IOError("File %s not found" % filepath)
+        if self._is_tiff(filepath):
+            with tf.TiffFile(filepath) as tif:
+                for frame, page in enumerate(tif.pages):
+                    yield loaded(self._as_rgb(page.asarray()),
+                                 {"frame": frame})
+            return
+
+        capture = self._open_video(filepath)
+        try:
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            frame = 0
+            ok, bgr_image = capture.read()
+            while ok:
+                rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB,
+                                         dst=bgr_image)
+                yield loaded(rgb_image,
+                             {"frame": frame,
+                              "timestamp_s": _timestamp(frame, fps)})
+                frame += 1
+                ok, bgr_image = capture.read()
+        finally:
+            capture.release()
+
+
 class GreyscaleConverter(Converter):
     """Converts a color image to a greyscale image, by selecting one channel
     or by converting it to another color space and then selecting one channel.
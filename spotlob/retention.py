@@ -0,0 +1,137 @@
+"""
+Limit the memory used by the images of cached Spims. A cached Spim keeps
+all of its predecessors and their images in memory, which can be a lot
+for large images. A :class:`RetentionPolicy` can be given instead of
+`cached=True`, to keep only the images of some stages permanently and the
+others only as long as they fit into a budget. Images that have been
+removed are computed again from their predecessor, when they are needed.
+Alternatively, they can be spilled to memory-mapped files in a scratch
+directory, so images larger than the available memory can be used.
+
+.. code-block:: python
+
+    from spotlob.retention import RetentionPolicy
+    from spotlob.spim import Spim, SpimStage
+
+    policy = RetentionPolicy(pinned_stages=[SpimStage.loaded,
+                                            SpimStage.binarized],
+                             max_bytes=200 * 2**20)
+    spim = Spim.from_file("large_image.jpg", cached=policy)
+"""
+import collections
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+from .spim import SpimStage
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # still mapped on windows
+        pass
+
+
+class RetentionPolicy(object):
+    """Keeps the images of the pinned stages and the least recently used
+    images of all other stages, up to a total of `max_bytes`. The images
+    exceeding the budget are removed from their Spim and computed again on
+    demand, by applying the same process with the same parameter values to
+    the predecessor.
+
+    If a `spill_directory` is given, the images exceeding the budget are
+    written to `.npy` files in this directory instead and replaced by
+    read-only memory maps of these files. The files are removed, when the
+    Spim is deleted.
+    """
+
+    def __init__(self,
+                 pinned_stages=(SpimStage.loaded, SpimStage.binarized),
+                 max_bytes=None,
+                 spill_directory=None):
+        """
+        Parameters
+        ----------
+        pinned_stages : iterable of int, optional
+            SpimStages, whose images are always kept, by default the loaded
+            and the binarized image
+        max_bytes : int, optional
+            maximum size of the images of all other stages, by default there
+            is no limit
+        spill_directory : str, optional
+            scratch directory to spill images to, instead of computing them
+            again. It is created if it does not exist
+        """
+        self.pinned_stages = frozenset(pinned_stages)
+        self.max_bytes = max_bytes
+        self.spill_directory = spill_directory
+
+        if spill_directory is not None and \
+                not os.path.isdir(spill_directory):
+            os.makedirs(spill_directory)
+
+        # weak references of the spims, whose image can be removed, and
+        # the size of the images, least recently used first
+        self._entries = collections.OrderedDict()
+        self.held_bytes = 0
+
+    def __bool__(self):
+        # a spim with a retention policy keeps its predecessors
+        return True
+
+    def is_pinned(self, spim):
+        return spim.stage in self.pinned_stages
+
+    def register(self, spim):
+        """Keep track of the image of a spim, that has just been created or
+        computed again. Other images are removed, if the budget is exceeded
+        """
+        if self.is_pinned(spim):
+            return
+        if spim._recipe is None and self.spill_directory is None:
+            # can neither be computed again nor spilled
+            return
+
+        key = id(spim)
+        nbytes = spim._image.nbytes
+
+        def forget(_):
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.held_bytes -= entry[1]
+
+        self._entries[key] = (weakref.ref(spim, forget), nbytes)
+        self.held_bytes += nbytes
+        self._evict()
+
+    def touch(self, spim):
+        """Mark the image of a spim as recently used"""
+        key = id(spim)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+
+    def _evict(self):
+        # the most recently used image is always kept
+        while self.max_bytes is not None and \
+                self.held_bytes > self.max_bytes and \
+                len(self._entries) > 1:
+            _, (ref, nbytes) = self._entries.popitem(last=False)
+            self.held_bytes -= nbytes
+            spim = ref()
+            if spim is None:
+                continue
+            if self.spill_directory is not None:
+                self._spill(spim)
+            else:
+                spim._evict_image()
+
+    def _spill(self, spim):
+        fd, path = tempfile.mkstemp(suffix=".npy", dir=self.spill_directory)
+        os.close(fd)
+        np.save(path, spim._image)
+        spim._evict_image(np.load(path, mmap_mode="r"))
+        weakref.finalize(spim, _remove_file, path)
@@ -0,0 +1,211 @@
+"""
+Store pipelines as a compact json description: for every process its
+class and parameter values, or for a plugin the registered name and the
+function, that it applies. Such a file loads fast and never contains the
+transient state of a process, like cached preview images.
+
+Processes, that can not be described like this, for example plugins
+defined in a notebook, are stored as `dill` pickles within the json file.
+"""
+import base64
+import importlib
+import inspect
+
+import dill
+import numpy as np
+
+from .parameters import SpotlobParameterSet
+
+FORMAT_NAME = "spotlob-pipeline"
+FORMAT_VERSION = 1
+
+# attributes of a process, that are stored separately or not at all
+_PROCESS_STATE = ("outdated", "function", "parameters")
+
+
+def _object_path(obj):
+    return obj.__module__ + ":" + obj.__qualname__
+
+
+def _import_object(path):
+    module_name, qualname = path.split(":")
+    obj = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _is_importable(obj):
+    try:
+        return _import_object(_object_path(obj)) is obj
+    except (AttributeError, ImportError, ValueError):
+        return False
+
+
+def encode_value(value):
+    """Describe an attribute value with json types. Objects are described by
+    their class and attributes.
+
+    Raises
+    ------
+    TypeError
+        if the value can not be described, for example because it is a
+        function or an object of a class, that can not be imported
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    elif isinstance(value, dict) and \
+            all(isinstance(k, str) for k in value) and \
+            "__object__" not in value and "__class__" not in value:
+        return dict((k, encode_value(v)) for k, v in value.items())
+    elif isinstance(value, type) and _is_importable(value):
+        return {"__class__": _object_path(value)}
+    elif hasattr(value, "__dict__") and not callable(value) and \
+            _is_importable(type(value)):
+        return {"__object__": _object_path(type(value)),
+                "attributes": encode_value(vars(value))}
+    raise TypeError("Can not describe %r" % (value,))
+
+
+def decode_value(description):
+    """Restore a value from the description of :func:`encode_value`"""
+    if isinstance(description, list):
+        return [decode_value(v) for v in description]
+    elif isinstance(description, dict):
+        if "__class__" in description:
+            return _import_object(description["__class__"])
+        elif "__object__" in description:
+            cls = _import_object(description["__object__"])
+            obj = cls.__new__(cls)
+            obj.__dict__.update(decode_value(description["attributes"]))
+            return obj
+        return dict((k, decode_value(v)) for k, v in description.items())
+    return description
+
+
+def _public_attributes(process):
+    return dict((name, value) for name, value in vars(process).items()
+                if not name.startswith("_") and name not in _PROCESS_STATE)
+
+
+def _construct(process_class):
+    # create a process with its default arguments, or None for the
+    # arguments without default, which are replaced by the parameters
+    arguments = []
+    signature = inspect.signature(process_class.__init__)
+    for argument in list(signature.parameters.values())[1:]:
+        if argument.kind in (argument.VAR_POSITIONAL, argument.VAR_KEYWORD):
+            continue
+        if argument.default is argument.empty:
+            arguments.append(None)
+        else:
+            arguments.append(argument.default)
+    return process_class(*arguments)
+
+
+def _describe(process):
+    function = process.function
+    attributes = encode_value(_public_attributes(process))
+
+    if getattr(function, "__self__", None) is process:
+        # a process class, that applies one of its methods
+        if not _is_importable(type(process)):
+            raise TypeError("Process class can not be imported")
+        return {"class": _object_path(type(process)),
+                "parameters": encode_value(process.parameters.to_dict()),
+                "attributes": attributes}
+
+    if inspect.isfunction(function) and _is_importable(function):
+        # a plugin, see ProcessRegister
+        return {"plugin": function.__name__,
+                "class": _object_path(type(process)),
+                "function": _object_path(function),
+                "parameters": encode_value(process.parameters.parameters),
+                "attributes": attributes}
+
+    raise TypeError("The function of the process can not be imported")
+
+
+def process_from_description(description):
+    """Restore a process from the description of
+    :func:`process_description`"""
+    if "dill" in description:
+        return dill.loads(base64.b64decode(description["dill"]))
+
+    process_class = _import_object(description["class"])
+    if "plugin" in description:
+        process = process_class.__new__(process_class)
+        process.function = _import_object(description["function"])
+        process.parameters = SpotlobParameterSet(
+            decode_value(description["parameters"]))
+    else:
+        process = _construct(process_class)
+        for name, value in description["parameters"].items():
+            process.parameters[name].value = decode_value(value)
+
+    for name, value in description["attributes"].items():
+        setattr(process, name, decode_value(value))
+    return process
+
+
+def process_description(process):
+    """Describe a process with json types: its class and parameter values,
+    its plugin function or, if it can not be described otherwise, as a
+    base64 encoded `dill` pickle
+
+    Parameters
+    ----------
+    process : SpotlobProcessStep
+        the process to describe
+
+    Returns
+    -------
+    dict
+        json serializable description of the process
+    """
+    # import needs to be delayed to avoid circular imports
+    from .pipeline import process_signature
+
+    try:
+        description = _describe(process)
+        # the description must restore the same process
+        restored = process_from_description(description)
+        if process_signature(restored) == process_signature(process):
+            return description
+    except Exception:
+        pass
+    return {"dill": base64.b64encode(dill.dumps(process)).decode("ascii")}
+
+
+def pipeline_description(pipeline):
+    """Describe the processes of a pipeline with json types
+
+    Parameters
+    ----------
+    pipeline : Pipeline
+        the pipeline to describe
+
+    Returns
+    -------
+    dict
+        json serializable description of the pipeline
+    """
+    stages = sorted(pipeline.process_stage_dict)
+    return {"format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "processes": [process_description(
+                pipeline.process_stage_dict[stage]) for stage in stages]}
+
+
+def processes_from_description(description):
+    """Restore the processes of a pipeline from the description of
+    :func:`pipeline_description`"""
+    if description.get("format") != FORMAT_NAME or \
+            description.get("version", 0) > FORMAT_VERSION:
+        raise ValueError("Not a pipeline description of a supported "
+                         "version")
+    return [process_from_description(d) for d in description["processes"]]
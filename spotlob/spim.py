@@ -48,6 +48,7 @@ data is still needed, it can contain a reference to its predecessors.
 """
 
 
+import numpy
 import pandas
 
 
@@ -70,7 +71,22 @@ class Spim(object):
     """Spotlob image item"""
     # TODO: describe nature of Spim, immutable concept
 
-    def __init__(self, image, metadata, stage, cached, predecessors):
+    __slots__ = ("_image", "metadata", "stage", "cached", "predecessors",
+                 "_recipe", "_evicted", "__weakref__")
+
+    # names of the methods, that can be applied at every stage
+    _stage_functions = ("read",
+                        "convert",
+                        "preprocess",
+                        "binarize",
+                        "postprocess",
+                        "extract_features",
+                        "filter_features",
+                        "analyze",
+                        "store")
+
+    def __init__(self, image, metadata, stage, cached, predecessors,
+                 recipe=None):
         """A Spim is a **Spotlob image item**, an object representing an image
         and the metadata that is collected along the process through a
         pipeline.
@@ -83,13 +99,19 @@ class Spim(object):
             the data desribing the image and containing results
         stage : SpimStage
             the stage along the pipeline the image has passed
-        cached : bool
+        cached : bool or RetentionPolicy
             if this is true, a reference to predecessors of this Spim are
             stored and they are kept in memory. This is required if a process
-            step is to be repeated
+            step is to be repeated. With a
+            :class:`~spotlob.retention.RetentionPolicy`, the predecessors are
+            kept, but their images only as far as the policy allows
         predecessors : dict(SpimStage, Spim)
             a registry of predecessors of the current spim, stored alongside
             the stage they are in
+        recipe : tuple, optional
+            the process, that created the image of this Spim, and its
+            parameter values, to compute the image again if it has been
+            removed by a retention policy
         """
 
         self._image = image
@@ -97,12 +119,17 @@ class Spim(object):
         self.stage = stage
         self.cached = cached
         self.predecessors = predecessors
+        self._recipe = recipe
+        self._evicted = False
 
         if image is not None:
-            self.metadata.update({"image_shape": image.shape})
+            if self.metadata.get("image_shape") != image.shape:
+                self.metadata["image_shape"] = image.shape
+            if self._retention is not None:
+                self._retention.register(self)
 
     @classmethod
-    def from_file(cls, image_filepath, cached=False):
+    def from_file(cls, image_filepath, cached=False, frame=None):
         """Create a Spim object from an image file. The path is stored in the
         Spim object, but the image is not yet loaded.
 
@@ -113,11 +140,18 @@ class Spim(object):
             reader that is given when the `read`-function is called. If an
             invalid image type is given at this stage, it will not be
             recognized
-        cached : bool, optional
+        cached : bool or RetentionPolicy, optional
             If the spim is to be cached, a reference to predecessors will be
             kept and not be deleted by the garbage collector. This allows to
             go back to an earlier stage after applying processes, but is more
-            memory consuming. (the default is False)
+            memory consuming. (the default is False). A
+            :class:`~spotlob.retention.RetentionPolicy` limits the memory
+            used by the images of the predecessors
+        frame : int, optional
+            index of the frame, if the file is a stack of images, like a
+            multi-page tiff or a video. It is stored in the metadata and
+            given to the reader, which must support it, like
+            :class:`~spotlob.process_opencv.StackReader`
 
         Returns
         -------
@@ -127,6 +161,8 @@ class Spim(object):
         """
 
         md = {"filepath": image_filepath}
+        if frame is not None:
+            md["frame"] = frame
         return Spim(None,
                     md,
                     SpimStage.new,
@@ -151,12 +187,72 @@ class Spim(object):
         """
 
         if not (self._image is None):
+            if self._retention is not None:
+                self._retention.touch(self)
             return self._image
+        elif self._evicted:
+            return self._recompute_image()
         elif self.cached:
             return self.predecessor_image()
         else:
             raise Exception("image not found, has not been cached")
 
+    @property
+    def _retention(self):
+        # the retention policy, if this spim is cached with one
+        if hasattr(self.cached, "register"):
+            return self.cached
+        return None
+
+    def _recipe_of(self, process):
+        if self._retention is None:
+            return None
+        return (process, process.parameters.to_dict())
+
+    def _evict_image(self, spilled=None):
+        # called by the retention policy to free the memory of the image,
+        # it is either computed again or replaced by a memory map
+        self._image = spilled
+        self._evicted = spilled is None
+
+    def _recompute_image(self):
+        process, parameters = self._recipe
+        if self.stage == SpimStage.loaded:
+            image, _ = process.function(*self._reader_args(), **parameters)
+        else:
+            source = self.predecessors[self.stage - 1]
+            image = process.function(source.image, **parameters)
+
+        self._image = image
+        self._evicted = False
+        self._retention.register(self)
+        return image
+
+    def memory_usage(self):
+        """The memory held by the images of this Spim and all its cached
+        predecessors
+
+        Returns
+        -------
+        pandas.Dataframe
+            one row per stage, with the size of the image in memory in
+            bytes as `image_bytes`, the size of an image spilled to a file
+            as `spilled_bytes` and whether it has been removed by a
+            retention policy as `evicted`
+        """
+        chain = self._predecessors_and_self() if self.cached \
+            else {self.stage: self}
+        rows = []
+        for stage in sorted(chain):
+            image = chain[stage]._image
+            nbytes = 0 if image is None else image.nbytes
+            spilled = isinstance(image, numpy.memmap)
+            rows.append({"stage": stage,
+                         "image_bytes": 0 if spilled else nbytes,
+                         "spilled_bytes": nbytes if spilled else 0,
+                         "evicted": chain[stage]._evicted})
+        return pandas.DataFrame(rows).set_index("stage")
+
     def predecessor_image(self):
         predecessor_stages = self.predecessors.keys()
         predecessor_stages = sorted(predecessor_stages)
@@ -167,15 +263,22 @@ class Spim(object):
                 return p.image
         raise Exception("no image found")
 
+    def _reader_args(self):
+        # the file and, within a stack, the frame to read
+        if "frame" in self.metadata:
+            return self.metadata["filepath"], self.metadata["frame"]
+        return self.metadata["filepath"],
+
     def read(self, reader):
-        im, metadata = reader.apply(self.metadata["filepath"])
+        im, metadata = reader.apply(*self._reader_args())
         metadata.update(self.metadata)
         metadata.update({"image_shape": im.shape})
         return Spim(im,
                     metadata,
                     SpimStage.loaded,
                     self.cached,
-                    self._predecessors_and_self())
+                    self._predecessors_and_self(),
+                    self._recipe_of(reader))
 
     def apply_process(self, process):
         assert self.stage == process.input_stage
@@ -184,7 +287,8 @@ class Spim(object):
                     self.metadata.copy(),
                     self.stage + 1,
                     self.cached,
-                    self._predecessors_and_self())
+                    self._predecessors_and_self(),
+                    self._recipe_of(process))
 
     def convert(self, converter):
         return self.apply_process(converter)
@@ -201,7 +305,7 @@ class Spim(object):
     def extract_features(self, feature_extractor):
         contours = feature_extractor.apply(self.image)
         new_metadata = self.metadata.copy()
-        new_metadata.update({"contours": contours})
+        new_metadata["contours"] = contours
         newspim = Spim(None, new_metadata, SpimStage.features_extracted,
                        self.cached, self._predecessors_and_self())
         return newspim
@@ -262,17 +366,7 @@ class Spim(object):
             the function, that can be applied the given stage
         """
 
-        # TODO: the static map of functions should be defined elsewhere
-        functions = [self.read,
-                     self.convert,
-                     self.preprocess,
-                     self.binarize,
-                     self.postprocess,
-                     self.extract_features,
-                     self.filter_features,
-                     self.analyze,
-                     self.store]
-        return functions[spimstage]
+        return getattr(self, self._stage_functions[spimstage])
 
     def do_process_at_stage(self, process):
         """Apply the given process at at this Spim if the process fits
@@ -294,11 +388,10 @@ class Spim(object):
 
     def _predecessors_and_self(self):
         if self.cached:
-            outd = dict()
-            for p_stage, p_spim in self.predecessors.items():
-                if p_stage < self.stage:
-                    outd.update({p_stage: p_spim})
-            outd.update({self.stage: self})
+            outd = dict((p_stage, p_spim)
+                        for p_stage, p_spim in self.predecessors.items()
+                        if p_stage < self.stage)
+            outd[self.stage] = self
             return outd
         else:
             # TODO: should this return self
@@ -350,20 +443,120 @@ class Spim(object):
             # results is a dataframe
             # flatten to one dataframe
 
-            md_copy = self.metadata.copy()
+            md_copy = dict(self.metadata)
 
             results = md_copy.pop("results")
-            results["filepath"] = md_copy["filepath"]
 
             # TODO: find a way to include contours output in get_data
             # drop contours
             _ = md_copy.pop("contours")
 
-            md = pandas.Series(md_copy).to_frame().T
-
-            return results.merge(md, on="filepath")
+            if any(key in results.columns for key in md_copy):
+                # let the merge handle the duplicate columns
+                results = results.assign(filepath=md_copy["filepath"])
+                md = pandas.Series(md_copy).to_frame().T
+                return results.merge(md, on="filepath")
+
+            # broadcast the metadata onto the rows of the results, with the
+            # filepath first and the object dtype, as with a merge
+            keys = ["filepath"] + [k for k in md_copy if k != "filepath"]
+            values = numpy.empty((len(results), len(keys)), dtype=object)
+            for i, key in enumerate(keys):
+                values[:, i].fill(md_copy[key])
+            md = pandas.DataFrame(values, columns=keys, dtype=object)
+
+            return pandas.concat([results.reset_index(drop=True), md],
+                                 axis=1)
         else:
-            return pandas.Series(self.metadata).to_frame().T
+            return pandas.Series(dict(self.metadata)).to_frame().T
 
     def __repr__(self):
         return "<Spim instance %s at stage %s>" % (id(self), self.stage)
+
+
+class LazySpim(object):
+    """A recipe for a Spim: an image file, a pipeline and a target stage.
+    The stages are computed only when the image, the metadata or the
+    results are requested, and only up to the stage that is needed. Every
+    computed stage is kept, so it is computed only once.
+
+    The stages are shared with the LazySpims returned by `get_at_stage`,
+    so for example the loaded image of a LazySpim at the analyzed stage can
+    be shown, without running the analysis.
+    """
+
+    def __init__(self, filepath, pipeline, stage=None, cached=True,
+                 _stages=None):
+        """
+        Parameters
+        ----------
+        filepath : str
+            path of the image file
+        pipeline : Pipeline
+            the pipeline to compute the stages with
+        stage : int, optional
+            SpimStage of this Spim, by default the stage after the last
+            process of the pipeline
+        cached : bool or RetentionPolicy, optional
+            passed to the Spim that the stages are computed from, by
+            default True, which allows to use all stages
+        """
+        self.filepath = filepath
+        self.pipeline = pipeline
+        self.stage = pipeline._maxstage() if stage is None else stage
+        self.cached = cached
+        if _stages is None:
+            _stages = {SpimStage.new: Spim.from_file(filepath, cached)}
+        self._stages = _stages
+
+    @property
+    def computed_stages(self):
+        """SpimStages that have been computed so far"""
+        return sorted(self._stages)
+
+    def materialize(self):
+        """Compute all stages up to the stage of this LazySpim, that have
+        not been computed yet
+
+        Returns
+        -------
+        Spim
+            the computed Spim
+        """
+        if self.stage not in self._stages:
+            done = max(st for st in self._stages if st < self.stage)
+            spim = self._stages[done]
+            for st in range(done, self.stage):
+                process = self.pipeline.process_stage_dict[st]
+                spim = spim.do_process_at_stage(process)
+                self._stages[st + 1] = spim
+        return self._stages[self.stage]
+
+    @property
+    def image(self):
+        return self.materialize().image
+
+    @property
+    def metadata(self):
+        return self.materialize().metadata
+
+    def get_data(self):
+        return self.materialize().get_data()
+
+    def get_at_stage(self, spimstage):
+        """A LazySpim at an earlier stage, that shares the computed stages
+        with this one"""
+        if spimstage > self.stage:
+            raise Exception("Spim has no predecessor at stage %s."
+                            % spimstage)
+        return LazySpim(self.filepath, self.pipeline, spimstage,
+                        self.cached, self._stages)
+
+    def __getattr__(self, name):
+        # everything else is taken from the computed Spim
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def __repr__(self):
+        return "<LazySpim instance %s at stage %s>" % (id(self), self.stage)
@@ -0,0 +1,247 @@
+"""
+A process pool, that supervises its workers. Every job gets its own
+time limit and a worker that exceeds it is killed, just as a worker that
+crashes is replaced by a new one. Only the job that the worker was busy
+with fails, the pool and all other jobs are not affected.
+
+The pool implements the interface of :class:`concurrent.futures.Executor`,
+so it can be used wherever an executor is expected, for example in
+:func:`spotlob.batch.batchprocess`.
+"""
+import collections
+from concurrent import futures
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import os
+import threading
+import time
+
+
+class JobTimeout(Exception):
+    """The job has not finished within the time limit"""
+
+
+class WorkerCrashed(Exception):
+    """The worker process died while working on the job"""
+
+
+def _worker_loop(conn, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        fn, args, kwargs = job
+        try:
+            result = (True, fn(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+
+        try:
+            conn.send(result)
+        except Exception as e:
+            # result or exception could not be pickled
+            conn.send((False, RuntimeError(repr(e))))
+
+
+class _Worker(object):
+    def __init__(self, context, initializer, initargs):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_loop,
+                                       args=(child_conn,
+                                             initializer,
+                                             initargs),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.future = None
+        self.deadline = None
+
+    def assign(self, future, fn, args, kwargs, timeout):
+        self.future = future
+        self.deadline = None if timeout is None else time.time() + timeout
+        self.conn.send((fn, args, kwargs))
+
+    def finish(self, success, result):
+        future = self.future
+        self.future = None
+        self.deadline = None
+        if success:
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class SupervisedProcessPool(futures.Executor):
+    """A pool of worker processes, that enforces a time limit per job and
+    replaces hung or crashed workers.
+
+    If a job exceeds the time limit, its future raises :class:`JobTimeout`,
+    if the worker process dies, its future raises :class:`WorkerCrashed`.
+    In both cases, the worker is replaced by a fresh process.
+    """
+
+    def __init__(self, max_workers=None, timeout=None,
+                 initializer=None, initargs=()):
+        """
+        Parameters
+        ----------
+        max_workers : int, optional
+            number of worker processes, defaults to the number of cpu cores
+        timeout : float, optional
+            time limit in seconds for every job, by default there is no limit
+        initializer : callable, optional
+            called in every new worker process before the first job
+        initargs : tuple, optional
+            arguments for `initializer`
+        """
+        if max_workers is None:
+            max_workers = os.cpu_count()
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._initializer = initializer
+        self._initargs = initargs
+        self._context = mp.get_context()
+
+        self._jobs = collections.deque()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(
+            duplex=False)
+
+        self._workers = [self._new_worker() for _ in range(max_workers)]
+        self._supervisor = threading.Thread(target=self._supervise,
+                                            daemon=True)
+        self._supervisor.start()
+
+    def _new_worker(self):
+        return _Worker(self._context, self._initializer, self._initargs)
+
+    def submit(self, fn, *args, **kwargs):
+        future = futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            self._jobs.append((future, fn, args, kwargs))
+        self._wakeup_writer.send(None)
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            was_shutdown = self._shutdown
+            self._shutdown = True
+        if not was_shutdown:
+            self._wakeup_writer.send(None)
+        if wait:
+            self._supervisor.join()
+
+    def _next_job(self):
+        with self._lock:
+            while self._jobs:
+                future, fn, args, kwargs = self._jobs.popleft()
+                if future.set_running_or_notify_cancel():
+                    return future, fn, args, kwargs
+            return None
+
+    def _replace_worker(self, i, exception=None):
+        worker = self._workers[i]
+        if exception is not None:
+            worker.finish(False, exception)
+        worker.kill()
+        self._workers[i] = self._new_worker()
+
+    def _assign_jobs(self):
+        for i in range(len(self._workers)):
+            if self._workers[i].future is not None:
+                continue
+            if not self._workers[i].process.is_alive():
+                self._replace_worker(i)
+
+            job = self._next_job()
+            if job is None:
+                return
+            future, fn, args, kwargs = job
+            try:
+                self._workers[i].assign(future, fn, args, kwargs,
+                                        self.timeout)
+            except (OSError, EOFError):
+                self._replace_worker(i, WorkerCrashed(
+                    "worker process could not receive the job"))
+
+    def _supervise(self):
+        while True:
+            self._assign_jobs()
+
+            busy = [w for w in self._workers if w.future is not None]
+            with self._lock:
+                finished = self._shutdown and not busy and not self._jobs
+            if finished:
+                break
+
+            deadlines = [w.deadline for w in busy if w.deadline is not None]
+            if deadlines:
+                wait_time = max(0, min(deadlines) - time.time())
+            else:
+                wait_time = None
+
+            waitables = [self._wakeup_reader]
+            for w in busy:
+                waitables += [w.conn, w.process.sentinel]
+            ready = wait(waitables, timeout=wait_time)
+
+            if self._wakeup_reader in ready:
+                while self._wakeup_reader.poll():
+                    self._wakeup_reader.recv()
+
+            for i, worker in enumerate(self._workers):
+                if worker.future is None:
+                    continue
+
+                if worker.conn in ready:
+                    try:
+                        success, result = worker.conn.recv()
+                    except (EOFError, OSError):
+                        # the worker died, without sending a result
+                        pass
+                    else:
+                        worker.finish(success, result)
+                        continue
+
+                if worker.conn in ready or worker.process.sentinel in ready:
+                    worker.process.join()
+                    self._replace_worker(i, WorkerCrashed(
+                        "worker process exited with code %s"
+                        % worker.process.exitcode))
+                elif worker.deadline is not None and \
+                        time.time() >= worker.deadline:
+                    self._replace_worker(i, JobTimeout(
+                        "job did not finish within %s seconds"
+                        % self.timeout))
+
+        for worker in self._workers:
+            worker.stop()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
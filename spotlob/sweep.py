@@ -0,0 +1,192 @@
+"""
+Apply a pipeline with many combinations of parameter values, to find the
+values that work best for a set of images.
+
+The combinations are evaluated as a prefix tree: the stages of an image
+are computed once for every distinct combination of the parameters of
+the processes up to that stage, and the later processes branch off from
+there. If for example three kernel sizes of the preprocessing and four
+minimal areas of the feature filter are combined, every image is read and
+converted once, preprocessed, binarized and its features extracted three
+times and filtered and analyzed twelve times.
+
+.. code-block:: python
+
+    from spotlob.spim import SpimStage
+    from spotlob.sweep import ParameterSweep
+
+    sweep = ParameterSweep(my_pipeline,
+                           {SpimStage.converted: {"kernelsize": [1, 3, 5]},
+                            SpimStage.features_extracted: {
+                                "minimal_area": [100, 200, 400, 800]}})
+    results = sweep.run(image_files, executor="processes")
+"""
+import collections
+import copy
+import hashlib
+import itertools
+
+import dill
+import pandas as pd
+
+from .batch import _make_executor, _job_options
+from .instrumentation import STEP_NAMES
+from .spim import Spim
+
+# sweeps loaded within a worker process, by the hash of the pickled sweep
+_worker_sweeps = dict()
+
+
+def _apply_pickled(pickled_sweep, image_file):
+    key = hashlib.sha1(pickled_sweep).hexdigest()
+    if key not in _worker_sweeps:
+        _worker_sweeps.clear()
+        _worker_sweeps[key] = dill.loads(pickled_sweep)
+    return _worker_sweeps[key].apply(image_file)
+
+
+class ParameterSweep(object):
+    """A grid of parameter values for the processes of a pipeline, that
+    are applied to images in every combination"""
+
+    def __init__(self, pipeline, grid):
+        """
+        Parameters
+        ----------
+        pipeline : Pipeline
+            the pipeline, whose parameters are varied. It is not modified,
+            the processes are copied for every combination
+        grid : dict
+            the values of the parameters to combine, by the input stage of
+            the process, as a dict of parameter name and a list of values,
+            for example `{SpimStage.preprocessed: {"threshold": [50, 100]}}`
+        """
+        self.pipeline = pipeline
+        self.grid = grid
+
+        unknown = set(grid) - set(pipeline.process_stage_dict)
+        if unknown:
+            raise ValueError("The pipeline has no process at stage %s"
+                             % ", ".join(str(st) for st in sorted(unknown)))
+
+        # the variants of every process, as tuples of the tags, i.e. the
+        # parameter values by column name, and the process
+        self._variants = dict()
+        for stage, process in pipeline.process_stage_dict.items():
+            self._variants[stage] = self._process_variants(
+                stage, process, grid.get(stage, dict()))
+
+    @staticmethod
+    def tag_column(stage, parameter_name):
+        """Name of the column, that holds the value of a swept parameter
+        in the results, like `binarize.threshold`"""
+        return "%s.%s" % (STEP_NAMES[stage], parameter_name)
+
+    def _process_variants(self, stage, process, parameter_grid):
+        names = list(parameter_grid)
+        for name in names:
+            if name not in process.parameters.names:
+                raise ValueError("%s has no parameter %s"
+                                 % (type(process).__name__, name))
+
+        variants = []
+        for values in itertools.product(*[parameter_grid[n] for n in names]):
+            if names:
+                variant = copy.deepcopy(process)
+                for name, value in zip(names, values):
+                    variant.parameters[name].value = value
+            else:
+                variant = process
+            tags = collections.OrderedDict(
+                (self.tag_column(stage, n), v) for n, v in zip(names, values))
+            variants.append((tags, variant))
+        return variants
+
+    @property
+    def n_combinations(self):
+        """Number of parameter combinations, that are applied to every
+        image"""
+        n = 1
+        for variants in self._variants.values():
+            n *= len(variants)
+        return n
+
+    def apply(self, image_file):
+        """Apply all combinations of parameters onto one image
+
+        Parameters
+        ----------
+        image_file : str
+            path of the image
+
+        Returns
+        -------
+        pandas.Dataframe
+            results of all combinations, as returned by
+            :meth:`Spim.get_data`, with one additional column for every
+            swept parameter
+        """
+        results = []
+        self._apply_branches(Spim.from_file(image_file),
+                             collections.OrderedDict(),
+                             results)
+        return pd.concat(results, ignore_index=True)
+
+    def _apply_branches(self, spim, tags, results):
+        # depth first through the prefix tree, so only the spims of the
+        # current branch are kept
+        if spim.stage not in self._variants:
+            data = spim.get_data()
+            for column, value in tags.items():
+                data[column] = [value] * len(data)
+            results.append(data)
+            return
+
+        for variant_tags, process in self._variants[spim.stage]:
+            branch_tags = tags.copy()
+            branch_tags.update(variant_tags)
+            self._apply_branches(spim.do_process_at_stage(process),
+                                 branch_tags,
+                                 results)
+
+    def run(self, image_files, executor="serial", workers=None):
+        """Apply all combinations of parameters onto images
+
+        Parameters
+        ----------
+        image_files : iterable of str
+            paths of the images
+        executor : str or concurrent.futures.Executor, optional
+            "serial" (default), "threads", "processes" or an executor
+            instance, to process the images in parallel, see
+            :func:`~spotlob.batch.batchprocess_iter`
+        workers : int, optional
+            number of threads or processes, defaults to the number of
+            cpu cores
+
+        Returns
+        -------
+        pandas.Dataframe
+            results of all images and combinations, with one additional
+            column for every swept parameter
+        """
+        if executor == "serial":
+            results = [self.apply(image_file) for image_file in image_files]
+            return pd.concat(results, ignore_index=True)
+
+        if isinstance(executor, str):
+            pool = _make_executor(executor, workers, (),
+                                  _job_options("raise", None, 0))
+        else:
+            pool = executor
+
+        try:
+            # the processes might not be picklable without dill
+            pickled_sweep = dill.dumps(self)
+            jobs = [pool.submit(_apply_pickled, pickled_sweep, image_file)
+                    for image_file in image_files]
+            results = [job.result() for job in jobs]
+        finally:
+            if pool is not executor:
+                pool.shutdown()
+        return pd.concat(results, ignore_index=True)
@@ -1,10 +1,21 @@
 import unittest
 import os
+import tempfile
+import shutil
+import numpy as np
+import pandas as pd
+import tifffile as tf
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
 from pkg_resources import resource_filename
 from pandas.testing import assert_frame_equal
 
-from ..batch import batchprocess
+from ..batch import batchprocess, batchprocess_iter, BatchSession,\
+    is_error_record, _worker_pipeline
 from ..defaults import default_pipeline
+from ..process_opencv import StackReader
+from ..instrumentation import BatchStatistics
+from ..pipeline import Pipeline
 from ..spim import SpimStage
 
 
@@ -39,5 +50,317 @@ class BatchProcessingTestCase(unittest.TestCase):
 
         self.assertEqual(len(results_mp), 20+22)
 
+    def test_batchprocess_iter_yields_per_image(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+
+        results = list(batchprocess_iter(self.temp_pipe_filename,
+                                         iter(small_batch)))
+        self.assertEqual([len(r) for r in results], [22, 20])
+
+        unordered = batchprocess_iter(self.temp_pipe_filename,
+                                      small_batch,
+                                      multiprocessing=True,
+                                      ordered=False,
+                                      max_in_flight=1)
+        n_features = sorted(len(r) for r in unordered)
+        self.assertEqual(n_features, [20, 22])
+
+    def test_batchprocess_chunksize(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+
+        results_single = batchprocess(self.temp_pipe_filename,
+                                      small_batch,
+                                      multiprocessing=True)
+        results_chunked = batchprocess(self.temp_pipe_filename,
+                                       small_batch,
+                                       multiprocessing=True,
+                                       chunksize=2)
+        assert_frame_equal(results_single, results_chunked)
+
+    def test_batchprocess_executor_backends(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+
+        results_serial = batchprocess(self.temp_pipe_filename,
+                                      small_batch,
+                                      executor="serial")
+        results_threads = batchprocess(self.temp_pipe_filename,
+                                       small_batch,
+                                       executor="threads",
+                                       workers=2)
+        results_processes = batchprocess(self.temp_pipe_filename,
+                                         small_batch,
+                                         executor="processes",
+                                         workers=2)
+        with ThreadPoolExecutor(max_workers=3) as my_executor:
+            results_custom = batchprocess(self.temp_pipe_filename,
+                                          small_batch,
+                                          executor=my_executor)
+
+        assert_frame_equal(results_serial, results_threads)
+        assert_frame_equal(results_serial, results_processes)
+        assert_frame_equal(results_serial, results_custom)
+
+        self.assertRaises(ValueError, batchprocess, self.temp_pipe_filename,
+                          small_batch, executor="gpu")
+
+    def test_batch_session(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+
+        expected = batchprocess(self.temp_pipe_filename, small_batch)
+
+        for executor in ["serial", "threads", "processes"]:
+            with BatchSession(executor=executor,
+                              workers=2,
+                              pipeline_files=[self.temp_pipe_filename]) \
+                    as session:
+                # the same session can be reused for several batches
+                for _ in range(2):
+                    results = session.process(self.temp_pipe_filename,
+                                              small_batch)
+                    assert_frame_equal(results, expected)
+
+        self.assertRaises(RuntimeError, list,
+                          session.process_iter(self.temp_pipe_filename,
+                                               small_batch))
+
+    def test_batchprocess_stacks(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+        expected = batchprocess(self.temp_pipe_filename, small_batch)
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            # both images as pages of one stack, and a stack of one image
+            stack_file = os.path.join(tempdir, "stack.tif")
+            with tf.TiffWriter(stack_file) as tif:
+                for im_file in small_batch:
+                    tif.write(np.array(Image.open(im_file)))
+            single_file = os.path.join(tempdir, "single.tif")
+            tf.imwrite(single_file, np.array(Image.open(small_batch[1])))
+
+            stack_pipe = Pipeline.from_file(self.temp_pipe_filename)
+            stack_pipe.replaced_with(StackReader()).save(
+                self.temp_pipe_filename)
+
+            results = list(batchprocess_iter(self.temp_pipe_filename,
+                                             [stack_file, single_file],
+                                             executor="threads",
+                                             workers=2))
+            self.assertEqual([len(r) for r in results], [22, 20, 20])
+            self.assertEqual([r["frame"].iloc[0] for r in results],
+                             [0, 1, 0])
+            assert_frame_equal(
+                pd.concat(results[:2]).drop(columns=["filepath", "frame"]),
+                expected.drop(columns="filepath"))
+
+            records = batchprocess(self.temp_pipe_filename,
+                                   [stack_file, "missing.tif"],
+                                   errors="record")
+            self.assertEqual(records["filepath"].iloc[-1], "missing.tif")
+            self.assertTrue(records["error"].iloc[-1].startswith("OSError"))
+
+            self.assertRaises(ValueError, batchprocess,
+                              self.temp_pipe_filename, [stack_file],
+                              checkpoint=os.path.join(tempdir, "progress"))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_batchprocess_resume_from_checkpoint(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+        expected = batchprocess(self.temp_pipe_filename, small_batch)
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            manifest_path = os.path.join(tempdir, "results.progress")
+
+            # interrupted after the first two images
+            batchprocess(self.temp_pipe_filename, small_batch[:2],
+                         checkpoint=manifest_path)
+            with open(manifest_path) as f_:
+                self.assertEqual(len(f_.readlines()), 2)
+
+            # only the remaining image is processed and recorded
+            for executor in ["serial", "threads"]:
+                resumed = batchprocess(self.temp_pipe_filename, small_batch,
+                                       executor=executor,
+                                       checkpoint=manifest_path)
+                assert_frame_equal(resumed, expected)
+            with open(manifest_path) as f_:
+                self.assertEqual(len(f_.readlines()), 3)
+
+            unordered = batchprocess_iter(self.temp_pipe_filename,
+                                          small_batch,
+                                          executor="threads",
+                                          ordered=False,
+                                          checkpoint=manifest_path)
+            self.assertEqual(sorted(len(r) for r in unordered),
+                             [0, 20, 22])
+
+            # a modified pipeline invalidates all finished images
+            mypipe = default_pipeline()
+            mypipe.save(self.temp_pipe_filename)
+            batchprocess(self.temp_pipe_filename, small_batch,
+                         checkpoint=manifest_path)
+            with open(manifest_path) as f_:
+                self.assertEqual(len(f_.readlines()), 6)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_batchprocess_record_errors(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            corrupt_file = os.path.join(tempdir, "corrupt.jpg")
+            with open(corrupt_file, "wb") as f_:
+                f_.write(b"this is not an image")
+            batch = [small_batch[0], corrupt_file, small_batch[1]]
+
+            self.assertRaises(IOError, batchprocess,
+                              self.temp_pipe_filename, batch)
+
+            for executor, timeout in [("serial", None),
+                                      ("threads", None),
+                                      ("processes", 60)]:
+                results = list(batchprocess_iter(self.temp_pipe_filename,
+                                                 batch,
+                                                 executor=executor,
+                                                 errors="record",
+                                                 timeout=timeout))
+                self.assertEqual([is_error_record(r) for r in results],
+                                 [False, True, False])
+                error = results[1].iloc[0]
+                self.assertEqual(error["filepath"], corrupt_file)
+                self.assertEqual(error["error_stage"], SpimStage.new)
+                self.assertEqual(error["error_process"], "SimpleReader")
+                self.assertTrue(error["error"].startswith("OSError"))
+                self.assertEqual([len(r) for r in results], [22, 1, 20])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_batchprocess_checkpoint_record_errors(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            missing_file = os.path.join(tempdir, "missing.jpg")
+            checkpoint = os.path.join(tempdir, "batch.progress")
+            for _ in range(2):
+                # a missing file is tried again, when the batch is resumed
+                results = list(batchprocess_iter(self.temp_pipe_filename,
+                                                 small_batch + [missing_file],
+                                                 errors="record",
+                                                 checkpoint=checkpoint))
+                self.assertEqual([is_error_record(r) for r in results],
+                                 [False, False, True])
+                self.assertEqual(results[2].iloc[0]["filepath"],
+                                 missing_file)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_batchprocess_prefetch(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+        expected = batchprocess(self.temp_pipe_filename, small_batch * 2)
+
+        for executor, chunksize in [("serial", 1), ("threads", 4)]:
+            results = batchprocess(self.temp_pipe_filename,
+                                   small_batch * 2,
+                                   executor=executor,
+                                   chunksize=chunksize,
+                                   prefetch=2)
+            assert_frame_equal(results, expected)
+
+        # with one image per job, no image is read ahead
+        with self.assertWarns(UserWarning):
+            batchprocess(self.temp_pipe_filename, small_batch,
+                         executor="threads", prefetch=2)
+
+        # errors while reading in the background are recorded
+        # like errors in the foreground
+        missing_file = os.path.join(tempfile.gettempdir(), "missing.jpg")
+        results = list(batchprocess_iter(self.temp_pipe_filename,
+                                         [missing_file] + small_batch,
+                                         errors="record",
+                                         prefetch=2))
+        self.assertEqual([is_error_record(r) for r in results],
+                         [True, False, False, False])
+        self.assertEqual(results[0].iloc[0]["error_process"], "SimpleReader")
+
+    def test_batchprocess_statistics(self):
+        small_batch_f = ["testdata4.JPG", "testdata5.JPG", "testdata6.JPG"]
+        small_batch = [resource_filename("spotlob.tests",
+                                         os.path.join("resources/", im_file))
+                       for im_file in small_batch_f]
+        expected = batchprocess(self.temp_pipe_filename, small_batch)
+
+        for executor in ["serial", "threads"]:
+            progress = []
+            stats = BatchStatistics(
+                progress_callback=lambda s: progress.append(s.n_images))
+            results = batchprocess(self.temp_pipe_filename,
+                                   small_batch,
+                                   executor=executor,
+                                   statistics=stats)
+            assert_frame_equal(results, expected)
+            self.assertEqual(progress, [1, 2, 3])
+
+            per_image = stats.per_image()
+            self.assertEqual(list(per_image["filepath"]), small_batch)
+            self.assertEqual(list(per_image["n_features_filtered"]),
+                             [22, 20, 0])
+            self.assertTrue((per_image["file_bytes"] > 0).all())
+
+            summary = stats.summary()
+            self.assertEqual(list(summary.index),
+                             ["read", "convert", "preprocess", "binarize",
+                              "postprocess", "extract_features",
+                              "filter_features", "analyze", "get_data"])
+            self.assertTrue((summary["count"] == 3).all())
+            self.assertAlmostEqual(summary["share"].sum(), 1)
+            self.assertGreater(stats.images_per_second(), 0)
+
+        # a missing file is recorded like without statistics
+        missing_file = os.path.join(tempfile.gettempdir(), "missing.jpg")
+        stats = BatchStatistics()
+        results = list(batchprocess_iter(self.temp_pipe_filename,
+                                         [missing_file] + small_batch,
+                                         errors="record",
+                                         statistics=stats))
+        self.assertEqual([is_error_record(r) for r in results],
+                         [True, False, False, False])
+        self.assertEqual(results[0].iloc[0]["error_process"], "SimpleReader")
+        self.assertEqual(stats.n_images, 3)
+
+    def test_worker_pipeline_loaded_once(self):
+        first = _worker_pipeline(self.temp_pipe_filename)
+        second = _worker_pipeline(self.temp_pipe_filename)
+        self.assertIs(first, second)
+
     def tearDown(self):
         os.remove(self.temp_pipe_filename)
@@ -0,0 +1,198 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+from pkg_resources import resource_filename
+from pandas.testing import assert_frame_equal
+
+from ..batch import batchprocess, batchprocess_iter, is_error_record
+from ..cache import ResultCache, StageCache
+from ..defaults import default_pipeline
+from ..instrumentation import BatchStatistics
+from ..spim import SpimStage
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tempdir, "cache")
+        self.pipe_filename = os.path.join(self.tempdir, "temp.pipe")
+
+        mypipe = default_pipeline()
+        filterprocess = mypipe.process_stage_dict[SpimStage.features_extracted]
+        filterprocess.parameters["minimal_area"].value = 500
+        filterprocess.parameters["solidity_limit"].value = 0.5
+        mypipe.save(self.pipe_filename)
+        self.pipeline = mypipe
+
+        self.images = []
+        for im_file in ["testdata4.JPG", "testdata5.JPG"]:
+            source = resource_filename("spotlob.tests",
+                                       os.path.join("resources/", im_file))
+            target = os.path.join(self.tempdir, im_file)
+            shutil.copy(source, target)
+            self.images.append(target)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _cached_results(self, cache):
+        return sum(len(files) for _, _, files in os.walk(cache.directory))
+
+    def test_fingerprint(self):
+        fingerprint = self.pipeline.fingerprint()
+        self.assertEqual(fingerprint, self.pipeline.fingerprint())
+
+        # a changed parameter changes the fingerprint of all later stages
+        changed = default_pipeline()
+        self.assertNotEqual(changed.fingerprint(), fingerprint)
+        self.assertEqual(changed.fingerprint(SpimStage.binarized),
+                         self.pipeline.fingerprint(SpimStage.binarized))
+
+    def test_cache_hit_and_miss(self):
+        cache = ResultCache(self.cache_dir)
+        expected = batchprocess(self.pipe_filename, self.images, cache=cache)
+        self.assertEqual(self._cached_results(cache), 2)
+
+        # a renamed copy is found in the cache
+        renamed = os.path.join(self.tempdir, "renamed.JPG")
+        shutil.copy(self.images[0], renamed)
+        results = batchprocess(self.pipe_filename,
+                               [renamed, self.images[1]],
+                               executor="threads",
+                               cache=cache)
+        self.assertEqual(self._cached_results(cache), 2)
+        self.assertTrue((results["filepath"].iloc[:22] == renamed).all())
+        assert_frame_equal(results.drop(columns="filepath"),
+                           expected.drop(columns="filepath"))
+
+        # a modified pipeline does not use the cached results
+        default_pipeline().save(self.pipe_filename)
+        batchprocess(self.pipe_filename, self.images, cache=cache)
+        self.assertEqual(self._cached_results(cache), 4)
+
+        cache.invalidate(default_pipeline())
+        self.assertEqual(self._cached_results(cache), 2)
+        cache.clear()
+        self.assertEqual(self._cached_results(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_files_listed_twice(self):
+        cache = ResultCache(self.cache_dir)
+        expected = batchprocess(self.pipe_filename, self.images * 2)
+        for _ in range(2):
+            # first all misses, then all hits
+            results = batchprocess(self.pipe_filename, self.images * 2,
+                                   executor="threads", workers=2,
+                                   cache=cache)
+            assert_frame_equal(results, expected)
+        self.assertEqual(self._cached_results(cache), 2)
+        self.assertEqual(len(cache._pinned), 0)
+
+    def test_missing_file(self):
+        cache = ResultCache(self.cache_dir)
+        missing_file = os.path.join(self.tempdir, "missing.JPG")
+        results = list(batchprocess_iter(self.pipe_filename,
+                                         self.images + [missing_file],
+                                         errors="record",
+                                         cache=cache))
+        self.assertEqual([is_error_record(r) for r in results],
+                         [False, False, True])
+        self.assertEqual(self._cached_results(cache), 2)
+
+    def test_evict_least_recently_used(self):
+        cache = ResultCache(self.cache_dir)
+        fingerprint = self.pipeline.fingerprint()
+        result = pd.DataFrame({"area": range(100)})
+        for i in range(3):
+            cache.put(fingerprint, str(i), result)
+        entry_size = cache.size // 3
+
+        # the first entry has been used recently
+        self.assertIsNotNone(cache.get(fingerprint, "0"))
+
+        cache.max_bytes = 2 * entry_size
+        cache.put(fingerprint, "3", result)
+        self.assertIsNotNone(cache.get(fingerprint, "3"))
+        self.assertIsNone(cache.get(fingerprint, "1"))
+        self.assertIsNone(cache.get(fingerprint, "2"))
+        self.assertLessEqual(cache.size, 2 * entry_size)
+
+        # the size is restored from the directory
+        self.assertEqual(ResultCache(self.cache_dir).size, cache.size)
+
+        # a pinned entry, that is about to be loaded, is kept
+        self.assertTrue(cache._touch(fingerprint, "0", pin=True))
+        self.assertFalse(cache._touch(fingerprint, "1"))
+        cache.put(fingerprint, "4", result)
+        cache.put(fingerprint, "5", result)
+        self.assertIsNotNone(cache.get(fingerprint, "0"))
+        self.assertIsNone(cache.get(fingerprint, "4"))
+        cache._unpin(fingerprint, "0")
+        self.assertLessEqual(cache.size, 2 * entry_size)
+
+    def test_stage_cache(self):
+        stage_cache = StageCache(self.cache_dir)
+        expected = batchprocess(self.pipe_filename, self.images,
+                                stage_cache=stage_cache)
+        n_stages = SpimStage.features_filtered - SpimStage.loaded + 1
+        self.assertEqual(self._cached_results(stage_cache),
+                         n_stages * len(self.images))
+
+        # only the filter and the analysis are applied again
+        filterprocess = self.pipeline.process_stage_dict[
+            SpimStage.features_extracted]
+        filterprocess.parameters["minimal_area"].value = 800
+        self.pipeline.save(self.pipe_filename)
+        expected = batchprocess(self.pipe_filename, self.images)
+
+        stats = BatchStatistics()
+        results = batchprocess(self.pipe_filename, self.images,
+                               executor="threads",
+                               stage_cache=stage_cache,
+                               statistics=stats)
+        assert_frame_equal(results, expected)
+        self.assertEqual(sorted(stats.summary().index),
+                         ["analyze", "filter_features", "get_data"])
+        self.assertEqual(self._cached_results(stage_cache),
+                         (n_stages + 1) * len(self.images))
+
+        # the filtered contours of the former filter parameters remain
+        stage_cache.invalidate(self.pipeline)
+        self.assertEqual(self._cached_results(stage_cache),
+                         len(self.images))
+
+    def test_stage_cache_size_limit_in_processes(self):
+        stage_cache = StageCache(self.cache_dir)
+        batchprocess(self.pipe_filename, self.images, stage_cache=stage_cache)
+        max_bytes = stage_cache.size // 2
+        stage_cache.clear()
+
+        # the workers use copies of the cache, without its entries
+        stage_cache.max_bytes = max_bytes
+        self.assertEqual(
+            len(pickle.loads(pickle.dumps(stage_cache))._entries), 0)
+
+        batchprocess(self.pipe_filename, self.images,
+                     executor="processes", workers=2,
+                     stage_cache=stage_cache)
+        self.assertGreater(stage_cache.size, 0)
+        self.assertLessEqual(stage_cache.size, max_bytes)
+        self.assertEqual(StageCache(self.cache_dir).size, stage_cache.size)
+
+    def test_stage_cache_prefetch(self):
+        stage_cache = StageCache(self.cache_dir, stages=[SpimStage.loaded])
+        expected = batchprocess(self.pipe_filename, self.images, prefetch=2,
+                                stage_cache=stage_cache)
+        self.assertEqual(self._cached_results(stage_cache), len(self.images))
+
+        # the restored images are not read again
+        stats = BatchStatistics()
+        results = batchprocess(self.pipe_filename, self.images, prefetch=2,
+                               stage_cache=stage_cache, statistics=stats)
+        assert_frame_equal(results, expected)
+        self.assertNotIn("read", stats.summary().index)
+        self.assertIn("convert", stats.summary().index)
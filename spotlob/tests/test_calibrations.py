@@ -10,6 +10,7 @@ import pandas as pd
 import pandas.testing
 import numpy
 
+from ..analyze_circle import CircleAnalysis
 from ..calibration import Calibration
 from ..spim import Spim
 from ..defaults import default_pipeline
@@ -72,6 +73,16 @@ class TestCalibration(unittest.TestCase):
         numpy.testing.assert_array_equal(
             df_cal["radius_um"], numpy.array([1, 2]))
 
+    def test_scaled_calibration(self):
+        contour = numpy.array([[[0, 0]], [[0, 20]], [[20, 20]], [[20, 0]]],
+                              dtype=numpy.int32)
+        analysis = CircleAnalysis(calibration=Calibration(4))
+
+        # read at half the resolution, a pixel is twice as large
+        result = analysis.analyze({"contours": [contour], "scale": 0.5})
+        self.assertEqual(result["area_px2"][0], 400)
+        self.assertEqual(result["area_um2"][0], 100)
+
     def test_calibrate_circle_detection_results(self):
         filename = resource_filename("spotlob.tests",
                                      "resources/testdata5.JPG")
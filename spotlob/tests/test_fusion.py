@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+import numpy.testing
+from pkg_resources import resource_filename
+
+from ..defaults import default_pipeline
+from ..fusion import FusedBinarization
+from ..process_opencv import BinaryThreshold, OtsuThreshold, \
+    GaussianPreprocess
+from ..spim import Spim, SpimStage
+
+
+class SharpenPreprocess(GaussianPreprocess):
+    pass
+
+
+class FusedBinarizationTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.image = rng.randint(0, 256, (120, 90, 3)).astype(np.uint8)
+
+    def test_same_as_unfused(self):
+        for binarization in [OtsuThreshold(), BinaryThreshold(0),
+                             BinaryThreshold(100), BinaryThreshold(255)]:
+            for kernelsize in [1, 2, 3, 4]:
+                pipeline = default_pipeline().replaced_with(binarization)
+                pipeline = pipeline.replaced_with(
+                    GaussianPreprocess(kernelsize))
+                converter = pipeline.process_stage_dict[SpimStage.loaded]
+                fused = FusedBinarization.from_pipeline(pipeline)
+
+                for conversion in converter.parameters["conversion"].options:
+                    for invert in [False, True]:
+                        converter.parameters["conversion"].value = conversion
+                        converter.parameters["invert"].value = invert
+
+                        expected = self.image
+                        for process in fused.processes:
+                            expected = process.apply(expected)
+                        numpy.testing.assert_array_equal(
+                            fused.apply(self.image), expected)
+
+    def test_read_in_bgr_order(self):
+        filename = resource_filename("spotlob.tests",
+                                     "resources/testdata5.JPG")
+        pipeline = default_pipeline(thresholding="simple")
+        reader = pipeline.process_stage_dict[SpimStage.new]
+        converter = pipeline.process_stage_dict[SpimStage.loaded]
+        fused = FusedBinarization.from_pipeline(pipeline, SpimStage.new)
+        self.assertIs(fused.reader, reader)
+
+        for conversion in converter.parameters["conversion"].options:
+            for invert, downscale in [(False, 1), (True, 2)]:
+                converter.parameters["conversion"].value = conversion
+                converter.parameters["invert"].value = invert
+                reader.parameters["downscale"].value = downscale
+
+                binarized = fused.apply_to_spim(Spim.from_file(filename))
+                pipeline.fuse_steps = False
+                expected = pipeline.apply_from_stage_to_stage(
+                    Spim.from_file(filename),
+                    SpimStage.new,
+                    SpimStage.binarized)
+                pipeline.fuse_steps = True
+
+                numpy.testing.assert_array_equal(binarized.image,
+                                                 expected.image)
+                self.assertEqual(dict(binarized.metadata.items()),
+                                 dict(expected.metadata.items()))
+
+    def test_pipeline_fuses_uncached(self):
+        pipeline = default_pipeline()
+        self.assertIsNone(FusedBinarization.from_pipeline(
+            pipeline.replaced_with(SharpenPreprocess(1))))
+
+        filename = resource_filename("spotlob.tests",
+                                     "resources/testdata4.JPG")
+        loaded = Spim.from_file(filename).read(
+            pipeline.process_stage_dict[SpimStage.new])
+        self.assertIsInstance(pipeline._fused_steps(
+            loaded, SpimStage.loaded, SpimStage.analyzed), FusedBinarization)
+        self.assertIsNone(pipeline._fused_steps(
+            loaded, SpimStage.loaded, SpimStage.preprocessed))
+
+        cached = pipeline.apply_all_steps(Spim.from_file(filename, True))
+        fused = pipeline.apply_all_steps(Spim.from_file(filename))
+        pipeline.fuse_steps = False
+        unfused = pipeline.apply_all_steps(Spim.from_file(filename))
+
+        for spim in [fused, unfused]:
+            self.assertEqual(dict(spim.metadata.items()).keys(),
+                             dict(cached.metadata.items()).keys())
+            self.assertEqual(spim.metadata["image_shape"],
+                             cached.metadata["image_shape"])
+        numpy.testing.assert_array_equal(
+            fused.metadata["results"]["area_px2"],
+            cached.metadata["results"]["area_px2"])
+        numpy.testing.assert_array_equal(
+            unfused.metadata["results"]["area_px2"],
+            cached.metadata["results"]["area_px2"])
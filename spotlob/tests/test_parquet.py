@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from pkg_resources import resource_filename
+from numpy.testing import assert_array_almost_equal
+
+from ..defaults import default_pipeline
+from ..output import ParquetSink, Writer, expand_array_columns
+from ..spim import Spim
+
+try:
+    import pyarrow
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
+
+class ExpandArrayColumnsTestCase(unittest.TestCase):
+    def test_expand_circle_results(self):
+        filename = resource_filename(
+            "spotlob.tests", "resources/testdata4.JPG")
+        results = default_pipeline().apply_all_steps(
+            Spim.from_file(filename)).get_data()
+
+        expanded = expand_array_columns(results)
+
+        self.assertNotIn("contours", expanded.columns)
+        self.assertNotIn("ellipse_position_px", expanded.columns)
+        positions = np.vstack(results["ellipse_position_px"].values)
+        assert_array_almost_equal(expanded["ellipse_position_px_0"],
+                                  positions[:, 0])
+        assert_array_almost_equal(expanded["ellipse_position_px_1"],
+                                  positions[:, 1])
+        self.assertTrue(all(expanded[c].dtype != object
+                            for c in expanded.columns
+                            if c != "filepath"))
+
+
+@unittest.skipIf(not has_pyarrow, "pyarrow is not installed")
+class ParquetSinkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def test_append_results(self):
+        image_files = [resource_filename("spotlob.tests",
+                                         "resources/" + f)
+                       for f in ["testdata4.JPG", "testdata5.JPG"]]
+        pipeline = default_pipeline()
+        results = [pipeline.apply_all_steps(Spim.from_file(f)).get_data()
+                   for f in image_files]
+
+        parquet_file = os.path.join(self.tempdir, "results.parquet")
+        with ParquetSink(parquet_file, row_group_size=10) as sink:
+            for image_results in results * 3:
+                sink.write(image_results)
+
+        restored = pd.read_parquet(parquet_file)
+        expected = expand_array_columns(pd.concat(results * 3,
+                                                  ignore_index=True))
+
+        self.assertEqual(len(restored), len(expected))
+        self.assertEqual(list(restored.columns), list(expected.columns))
+        assert_array_almost_equal(restored["ellipse_position_px_0"],
+                                  expected["ellipse_position_px_0"])
+        self.assertEqual(pyarrow.parquet.ParquetFile(parquet_file)
+                         .metadata.num_row_groups, 6)
+
+    def test_writer_store_parquet(self):
+        filename = resource_filename(
+            "spotlob.tests", "resources/testdata4.JPG")
+        result = default_pipeline().apply_all_steps(
+            Spim.from_file(filename)).get_data()
+
+        parquet_file = os.path.join(self.tempdir, "results.parquet")
+        Writer(None, parquet_file).store_data(result)
+
+        self.assertEqual(len(pd.read_parquet(parquet_file)), len(result))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
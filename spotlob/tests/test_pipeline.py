@@ -1,3 +1,4 @@
+import json
 import unittest
 
 from pkg_resources import resource_filename
@@ -5,9 +6,17 @@ import numpy as np
 import numpy.testing
 
 from ..defaults import default_pipeline
+from ..pipeline import Pipeline, PipelineHook
+from ..process_opencv import TifReader
+from ..register import PROCESS_REGISTER
 from ..spim import Spim, SpimStage
 
 
+@PROCESS_REGISTER.binarization_plugin([("upper_threshold", (0, 255, 200))])
+def threshold_below(image, upper_threshold):
+    return (image < upper_threshold).astype(np.uint8) * 255
+
+
 class TestSpimLifecycle(unittest.TestCase):
     def test_portable_pipeline(self):
         mypipe = default_pipeline()
@@ -48,6 +57,51 @@ class TestSpimLifecycle(unittest.TestCase):
 
         numpy.testing.assert_array_equal(preproc_mypipe, preproc_loaded)
 
+    def test_declarative_pipeline_file(self):
+        def postprocess_nothing(image):
+            return image
+
+        PROCESS_REGISTER.postprocess_plugin([])(postprocess_nothing)
+
+        reader = TifReader()
+        reader.parameters["width_percent"].value = 50
+        reader._preview_image_cache = np.zeros((500, 500), np.uint8)
+
+        mypipe = default_pipeline().replaced_with(reader)
+        mypipe = mypipe.replaced_with(
+            PROCESS_REGISTER.available_processes["threshold_below"])
+        mypipe = mypipe.replaced_with(
+            PROCESS_REGISTER.available_processes["postprocess_nothing"])
+
+        filename = resource_filename(
+            "spotlob.tests", "resources/test_save.pipe")
+        mypipe.save(filename)
+        with open(filename) as f_:
+            description = json.load(f_)
+
+        # only the function defined in here needs to be pickled
+        processes = description["processes"]
+        self.assertEqual([sorted(p) for p in processes[:5]],
+                         [["attributes", "class", "parameters"]] * 3 +
+                         [["attributes", "class", "function", "parameters",
+                           "plugin"],
+                          ["dill"]])
+        self.assertEqual(processes[0]["attributes"], {})
+
+        loaded_pipe = Pipeline.from_file(filename)
+        self.assertEqual(loaded_pipe.fingerprint(), mypipe.fingerprint())
+        self.assertIsNone(loaded_pipe.process_stage_dict[
+            SpimStage.new]._preview_image_cache)
+        binarization = loaded_pipe.process_stage_dict[SpimStage.preprocessed]
+        numpy.testing.assert_array_equal(
+            binarization.apply(np.array([[100, 220]], np.uint8)),
+            [[255, 0]])
+
+        # pipelines stored with dill can still be loaded
+        mypipe.save(filename, format="dill")
+        self.assertEqual(Pipeline.from_file(filename).fingerprint(),
+                         mypipe.fingerprint())
+
     def test_pipeline_apply_all_stages(self):
         mypipe = default_pipeline()
         filename = resource_filename(
@@ -128,11 +182,79 @@ class TestSpimLifecycle(unittest.TestCase):
         self.assertIs(s1_final_updated.get_at_stage(last_unchanged_stage),
                       s_unchanged_ancestor)
 
+    def test_pipeline_apply_lazy(self):
+        mypipe = default_pipeline()
+        filename = resource_filename(
+            "spotlob.tests", "resources/testdata4.JPG")
+
+        lazy = mypipe.apply_lazy(filename)
+        self.assertEqual(lazy.stage, SpimStage.analyzed)
+        self.assertEqual(lazy.computed_stages, [SpimStage.new])
+
+        # only the stages up to the binarized image are computed
+        binarized = lazy.get_at_stage(SpimStage.binarized)
+        binarized_image = binarized.image
+        self.assertEqual(lazy.computed_stages,
+                         list(range(SpimStage.binarized + 1)))
+
+        # the following stages start from the computed ones
+        self.assertEqual(len(lazy.metadata["contours"]), 22)
+        self.assertIs(lazy.get_at_stage(SpimStage.binarized).image,
+                      binarized_image)
+
+        expected = mypipe.apply_all_steps(Spim.from_file(filename))
+        numpy.testing.assert_array_equal(
+            lazy.get_data()["area_px2"], expected.get_data()["area_px2"])
+
+    def test_pipeline_hooks(self):
+        mypipe = default_pipeline()
+        filename = resource_filename(
+            "spotlob.tests", "resources/testdata4.JPG")
+
+        class RecordingHook(PipelineHook):
+            def __init__(self):
+                self.calls = []
+                self.output_bytes = dict()
+
+            def before_step(self, stage, process, spim):
+                self.calls.append(("before", stage, spim.stage, process))
+
+            def after_step(self, stage, process, spim, output_spim, elapsed,
+                           output_bytes):
+                self.calls.append(("after", stage, output_spim.stage,
+                                   process))
+                self.output_bytes[stage] = output_bytes
+                assert elapsed >= 0
+
+        hook = RecordingHook()
+        mypipe.add_hook(hook)
+        mypipe.apply_all_steps(Spim.from_file(filename))
+
+        expected_calls = []
+        for stage in range(SpimStage.new, SpimStage.analyzed):
+            process = mypipe.process_stage_dict[stage]
+            expected_calls += [("before", stage, stage, process),
+                               ("after", stage, stage + 1, process)]
+        self.assertEqual(hook.calls, expected_calls)
+        self.assertEqual(hook.output_bytes[SpimStage.loaded], 1040 * 1388)
+        self.assertGreater(hook.output_bytes[SpimStage.features_extracted], 0)
+
+        # hooks are not stored with the pipeline
+        pipe_filename = resource_filename(
+            "spotlob.tests", "resources/test_save.pipe")
+        mypipe.save(pipe_filename)
+        self.assertEqual(Pipeline.from_file(pipe_filename).hooks, ())
+
+        mypipe.remove_hook(hook)
+        mypipe.apply_all_steps(Spim.from_file(filename))
+        self.assertEqual(len(hook.calls), len(expected_calls))
+
     def test_pipeline_to_str(self):
         mypipe = default_pipeline()
 
         expected_str_lines = [
             "SimpleReader\n",
+            "- downscale: 1\n",
             "GreyscaleConverter\n",
             "- conversion: Grey\n",
             "- invert: False\n",
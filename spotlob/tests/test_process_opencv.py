@@ -1,10 +1,15 @@
+import cv2
 import numpy as np
+import pytest
 import numpy.testing
 import imageio as im
 from PIL import Image
+import tifffile as tf
+from pkg_resources import resource_filename
 
-from ..process_opencv import TifReader
-from ..spim import Spim
+from ..process_opencv import SimpleReader, TifReader, StackReader,\
+    _timestamp
+from ..spim import Spim, SpimStage
 
 def test_partial_read_1():
     width = 1000
@@ -30,4 +35,147 @@ def test_partial_read_2():
     filename = "testtif.tif"
     im.imwrite(filename, array)
     array = TifReader().partial_read(filename, width_percent, height_percent, x0_percent, y0_percent)[0]
-    numpy.testing.assert_array_almost_equal(array, compare_array)
\ No newline at end of file
+    numpy.testing.assert_array_almost_equal(array, compare_array)
+
+def test_partial_read_compressed():
+    array = np.random.randint(255, size=(1000, 1200, 3), dtype=np.uint8)
+    filename = "testtif.tif"
+    for layout in [{"tile": (256, 128)}, {"rowsperstrip": 7}]:
+        tf.imwrite(filename, array, photometric="rgb", compression="zlib",
+                   **layout)
+        for roi in [(20, 15, 40, 40), (100, 100, 0, 0), (5, 5, 95, 95)]:
+            part, metadata = TifReader().partial_read(filename, *roi)
+            x0, y0, x1, y1 = metadata["ROI"]
+            numpy.testing.assert_array_equal(part, array[y0:y1, x0:x1])
+
+
+def _write_tiffs(filename, array, compression):
+    # tiles and strips, written by tifffile, and strips with shared
+    # jpeg tables, written by libtiff through pillow
+    for layout in [{"tile": (256, 128)}, {"rowsperstrip": 16}]:
+        tf.imwrite(filename, array, photometric="rgb",
+                   compression=compression, **layout)
+        yield
+    if compression == "jpeg":
+        Image.fromarray(array).save(filename, compression="jpeg")
+        with tf.TiffFile(filename) as tif:
+            assert tif.pages[0].jpegtables is not None
+        yield
+
+
+@pytest.mark.parametrize("compression", ["lzw", "jpeg"])
+def test_partial_read_imagecodecs(compression):
+    pytest.importorskip("imagecodecs")
+    array = np.random.randint(255, size=(1000, 1200, 3), dtype=np.uint8)
+    array = cv2.GaussianBlur(array, (15, 15), 0)
+    filename = "testtif.tif"
+    for _ in _write_tiffs(filename, array, compression):
+        # jpeg is lossy, the region must match the complete image
+        full = tf.imread(filename)
+        if compression == "lzw":
+            numpy.testing.assert_array_equal(full, array)
+        with tf.TiffFile(filename) as tif:
+            assert tif.pages[0].compression == \
+                {"lzw": 5, "jpeg": 7}[compression]
+        for roi in [(20, 15, 40, 40), (100, 100, 0, 0), (5, 5, 95, 95)]:
+            part, metadata = TifReader().partial_read(filename, *roi)
+            x0, y0, x1, y1 = metadata["ROI"]
+            numpy.testing.assert_array_equal(part, full[y0:y1, x0:x1])
+
+
+def test_partial_read_pyramid_level():
+    array = np.random.randint(255, size=(1024, 2048, 3), dtype=np.uint8)
+    filename = "testtif.tif"
+    with tf.TiffWriter(filename) as tif:
+        tif.write(array, photometric="rgb", tile=(256, 256), subifds=2)
+        for factor in [2, 4]:
+            tif.write(array[::factor, ::factor], photometric="rgb",
+                      tile=(256, 256), subfiletype=1)
+
+    reader = TifReader()
+    part, metadata = reader.partial_read(filename, 50, 50, 50, 50)
+    assert "scale" not in metadata
+    assert part.shape == (512, 1024, 3)
+
+    # the region has 0.5 megapixels at full resolution
+    for max_megapixels, level in [(1, 0), (0.2, 1), (0.1, 2), (0.01, 2)]:
+        part, metadata = reader.partial_read(filename, 50, 50, 50, 50,
+                                             max_megapixels=max_megapixels)
+        factor = 2 ** level
+        assert metadata["pyramid_level"] == level
+        assert metadata["scale"] == 1 / factor
+        numpy.testing.assert_array_equal(
+            part, array[::factor, ::factor][512 // factor:,
+                                            1024 // factor:])
+
+
+def test_simple_reader_downscale():
+    filename = resource_filename("spotlob.tests", "resources/testdata4.JPG")
+    reader = SimpleReader()
+    full, metadata = reader.fn_read(filename)
+    assert metadata == {}
+    for downscale in [2, 4, 8]:
+        reduced, metadata = reader.fn_read(filename, downscale)
+        assert metadata["scale"] == 1 / downscale
+        assert reduced.shape == (-(-full.shape[0] // downscale),
+                                 -(-full.shape[1] // downscale), 3)
+        # the colors are in the same order
+        numpy.testing.assert_allclose(reduced.mean(axis=(0, 1)),
+                                      full.mean(axis=(0, 1)), atol=1)
+
+
+def test_stack_reader(tmp_path):
+    frames = [np.full((64, 80, 3), 40 * i, dtype=np.uint8) for i in range(5)]
+    for frame in frames:
+        frame[10:30, 20:50] = 255
+
+    tiff_file = str(tmp_path / "stack.tif")
+    tf.imwrite(tiff_file, np.stack(frames))
+    video_file = str(tmp_path / "stack.avi")
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*"MJPG"),
+                             10, (80, 64))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+    reader = StackReader()
+    for filename in [tiff_file, video_file]:
+        assert reader.frame_count(filename) == 5
+        spims = list(reader.iter_frames(filename))
+        assert [s.metadata["frame"] for s in spims] == list(range(5))
+        for i in [3, 1]:
+            # reading a single frame gives the same image
+            spim = Spim.from_file(filename, frame=i).read(reader)
+            assert spim.stage == SpimStage.loaded
+            assert spim.metadata["frame"] == i
+            numpy.testing.assert_array_equal(spim.image, spims[i].image)
+            numpy.testing.assert_allclose(spim.image.mean(),
+                                          frames[i].mean(), atol=2)
+
+    assert spims[3].metadata["timestamp_s"] == 0.3
+    numpy.testing.assert_array_equal(
+        Spim.from_file(tiff_file, frame=2).read(reader).image, frames[2])
+
+    # the offsets of the pages are renewed, when the file is modified
+    tf.imwrite(tiff_file, np.stack(frames[::-1]))
+    assert reader.frame_count(tiff_file) == 5
+    numpy.testing.assert_array_equal(reader.read_frame(tiff_file, 4)[0],
+                                     frames[0])
+    with pytest.raises(IndexError):
+        reader.read_frame(tiff_file, 5)
+
+    # the frame count in the header is too large for a truncated video
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*"MJPG"),
+                             10, (80, 64))
+    for _ in range(20):
+        writer.write(np.random.randint(255, size=(64, 80, 3), dtype=np.uint8))
+    writer.release()
+    with open(video_file, "rb") as f_:
+        data = f_.read()
+    with open(video_file, "wb") as f_:
+        f_.write(data[:len(data) // 2])
+    n_frames = reader.frame_count(video_file)
+    assert 0 < n_frames < 20
+    assert n_frames == len(list(reader.iter_frames(video_file)))
+
+    assert _timestamp(3, 0) is None
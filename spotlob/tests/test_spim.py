@@ -1,11 +1,17 @@
 import sys
 import os
+import json
+import gc
+import shutil
+import tempfile
 import unittest
 
 from pkg_resources import resource_filename
 
 import numpy as np
 import numpy.random
+import pandas as pd
+from pandas.testing import assert_frame_equal
 from numpy.testing import assert_array_almost_equal,\
     assert_array_equal
 
@@ -14,6 +20,7 @@ from ..process_opencv import SimpleReader, \
     BinaryThreshold
 from ..defaults import default_pipeline
 from ..spim import Spim, SpimStage
+from ..retention import RetentionPolicy
 
 
 class TestSpimLifecycle(unittest.TestCase):
@@ -110,3 +117,110 @@ class TestSpimLifecycle(unittest.TestCase):
 
         assert s0_ is s0
         assert s1_ is s1
+
+    def test_retention_policy(self):
+        image_filepath = resource_filename("spotlob.tests",
+                                           "resources/testdata4.JPG")
+        pipeline = default_pipeline()
+        converted_bytes = 1040 * 1388
+
+        # keeps one greyscale image besides the pinned ones
+        policy = RetentionPolicy(pinned_stages=[SpimStage.loaded],
+                                 max_bytes=converted_bytes)
+        s0 = Spim.from_file(image_filepath, cached=policy)
+        s_final = pipeline.apply_all_steps(s0)
+
+        usage = s_final.memory_usage()
+        self.assertEqual(usage.loc[SpimStage.loaded, "image_bytes"],
+                         1040 * 1388 * 3)
+        self.assertTrue(usage.loc[SpimStage.converted, "evicted"])
+        self.assertTrue(usage.loc[SpimStage.preprocessed, "evicted"])
+        self.assertEqual(usage.loc[SpimStage.postprocessed, "image_bytes"],
+                         converted_bytes)
+        self.assertEqual(policy.held_bytes, converted_bytes)
+
+        # evicted images are computed again with the same parameters
+        expected = pipeline.apply_all_steps(Spim.from_file(image_filepath,
+                                                           cached=True))
+        for stage in [SpimStage.converted, SpimStage.binarized]:
+            assert_array_equal(s_final.get_at_stage(stage).image,
+                               expected.get_at_stage(stage).image)
+        self.assertLessEqual(policy.held_bytes, converted_bytes)
+        assert_array_equal(s_final.get_data()["area_px2"],
+                           expected.get_data()["area_px2"])
+
+    def test_spill_to_scratch_files(self):
+        image_filepath = resource_filename("spotlob.tests",
+                                           "resources/testdata4.JPG")
+        pipeline = default_pipeline()
+        converted_bytes = 1040 * 1388
+
+        scratch = tempfile.mkdtemp()
+        try:
+            policy = RetentionPolicy(pinned_stages=[],
+                                     max_bytes=converted_bytes,
+                                     spill_directory=scratch)
+            s_final = pipeline.apply_all_steps(
+                Spim.from_file(image_filepath, cached=policy))
+
+            usage = s_final.memory_usage()
+            self.assertEqual(usage.loc[SpimStage.loaded, "spilled_bytes"],
+                             converted_bytes * 3)
+            self.assertEqual(usage["image_bytes"].sum(), converted_bytes)
+            self.assertFalse(usage["evicted"].any())
+            self.assertEqual(len(os.listdir(scratch)), 4)
+
+            expected = pipeline.apply_all_steps(
+                Spim.from_file(image_filepath, cached=True))
+            for stage in [SpimStage.loaded, SpimStage.binarized]:
+                assert_array_equal(s_final.get_at_stage(stage).image,
+                                   expected.get_at_stage(stage).image)
+
+            # the files are removed with the spims
+            del s_final
+            gc.collect()
+            self.assertEqual(os.listdir(scratch), [])
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def test_get_data_columns(self):
+        image_filepath = resource_filename("spotlob.tests",
+                                           "resources/testdata4.JPG")
+        s_final = default_pipeline().apply_all_steps(
+            Spim.from_file(image_filepath))
+        s_final.metadata["comment"] = "no comment"
+
+        # same as merging the metadata into the results
+        md = dict(s_final.metadata)
+        results = md.pop("results").assign(filepath=image_filepath)
+        md.pop("contours")
+        expected = results.merge(pd.Series(md).to_frame().T, on="filepath")
+
+        data = s_final.get_data()
+        assert_frame_equal(data, expected)
+        self.assertEqual(list(data.columns[-3:]),
+                         ["filepath", "image_shape", "comment"])
+        self.assertNotIn("filepath", s_final.metadata["results"].columns)
+
+    def test_metadata_of_stages(self):
+        image_filepath = resource_filename("spotlob.tests",
+                                           "resources/testdata4.JPG")
+        s_final = default_pipeline().apply_all_steps(
+            Spim.from_file(image_filepath, cached=True))
+        extracted = s_final.get_at_stage(SpimStage.features_extracted)
+        filtered = s_final.get_at_stage(SpimStage.features_filtered)
+
+        self.assertIsInstance(filtered.metadata, dict)
+        self.assertEqual(filtered.metadata["filepath"], image_filepath)
+        self.assertLess(len(filtered.metadata["contours"]),
+                        len(extracted.metadata["contours"]))
+        self.assertEqual(set(s_final.metadata),
+                         {"filepath", "image_shape", "contours", "results"})
+        json.dumps(s_final.get_at_stage(SpimStage.loaded).metadata)
+
+        # every stage has its own metadata
+        loaded = s_final.get_at_stage(SpimStage.loaded)
+        loaded.metadata["filepath"] = "changed.jpg"
+        self.assertEqual(s_final.metadata["filepath"], image_filepath)
+        s_final.metadata["filepath"] = "final.jpg"
+        self.assertEqual(filtered.metadata["filepath"], image_filepath)
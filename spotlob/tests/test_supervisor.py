@@ -0,0 +1,42 @@
+import os
+import time
+import unittest
+
+from ..supervisor import SupervisedProcessPool, JobTimeout, WorkerCrashed
+
+
+def job(x):
+    if x == "hang":
+        time.sleep(60)
+    elif x == "crash":
+        os._exit(1)
+    elif x == "fail":
+        raise ValueError("failed")
+    return x * 2
+
+
+class SupervisedProcessPoolTestCase(unittest.TestCase):
+    def test_results(self):
+        pool = SupervisedProcessPool(max_workers=2)
+        try:
+            results = [pool.submit(job, i) for i in range(5)]
+            self.assertEqual([r.result() for r in results], [0, 2, 4, 6, 8])
+        finally:
+            pool.shutdown()
+
+    def test_failing_jobs_are_isolated(self):
+        pool = SupervisedProcessPool(max_workers=2, timeout=1)
+        try:
+            submitted = [pool.submit(job, x)
+                         for x in [1, "hang", "crash", "fail", 2, 3]]
+
+            self.assertEqual(submitted[0].result(), 2)
+            self.assertRaises(JobTimeout, submitted[1].result)
+            self.assertRaises(WorkerCrashed, submitted[2].result)
+            self.assertRaises(ValueError, submitted[3].result)
+            self.assertEqual(submitted[4].result(), 4)
+            self.assertEqual(submitted[5].result(), 6)
+        finally:
+            pool.shutdown()
+
+        self.assertRaises(RuntimeError, pool.submit, job, 1)
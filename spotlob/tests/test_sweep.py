@@ -0,0 +1,57 @@
+import unittest
+
+import pandas as pd
+from pkg_resources import resource_filename
+from pandas.testing import assert_frame_equal
+
+from ..defaults import default_pipeline
+from ..spim import Spim, SpimStage
+from ..sweep import ParameterSweep
+
+
+class ParameterSweepTestCase(unittest.TestCase):
+    def setUp(self):
+        self.images = [resource_filename("spotlob.tests",
+                                         "resources/" + im_file)
+                       for im_file in ["testdata4.JPG", "testdata5.JPG"]]
+        self.grid = {SpimStage.converted: {"kernelsize": [1, 5]},
+                     SpimStage.features_extracted: {
+                         "minimal_area": [100, 800]}}
+
+    def _expected(self):
+        expected = []
+        for image_file in self.images:
+            for kernelsize in self.grid[SpimStage.converted]["kernelsize"]:
+                for minimal_area in self.grid[
+                        SpimStage.features_extracted]["minimal_area"]:
+                    pipeline = default_pipeline()
+                    pipeline.process_stage_dict[SpimStage.converted]\
+                        .parameters["kernelsize"].value = kernelsize
+                    pipeline.process_stage_dict[SpimStage.features_extracted]\
+                        .parameters["minimal_area"].value = minimal_area
+                    data = pipeline.apply_all_steps(
+                        Spim.from_file(image_file)).get_data()
+                    data["preprocess.kernelsize"] = kernelsize
+                    data["filter_features.minimal_area"] = minimal_area
+                    expected.append(data)
+        return pd.concat(expected, ignore_index=True)
+
+    def test_sweep(self):
+        sweep = ParameterSweep(default_pipeline(), self.grid)
+        self.assertEqual(sweep.n_combinations, 4)
+
+        expected = self._expected()
+        assert_frame_equal(sweep.run(self.images), expected,
+                           check_dtype=False)
+        assert_frame_equal(sweep.run(self.images, executor="processes",
+                                     workers=2),
+                           expected,
+                           check_dtype=False)
+
+    def test_unknown_parameter(self):
+        with self.assertRaises(ValueError):
+            ParameterSweep(default_pipeline(),
+                           {SpimStage.converted: {"threshold": [1, 2]}})
+        with self.assertRaises(ValueError):
+            ParameterSweep(default_pipeline(),
+                           {SpimStage.analyzed: {"threshold": [1, 2]}})